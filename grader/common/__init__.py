@@ -1,10 +1,15 @@
+import functools
 import json
 import os
-import subprocess
 import pathlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+from .process import execute, ResourceUsage, DEFAULT_MAX_OUTPUT
 from .report import ErrorReport, BaseReport
-from .util import remove_extension, check_extension, load_json
+from .scheduler import Task, Scheduler, gather
+from .timeout import TimeoutPolicy, DEFAULT_TIMEOUT
+from .util import remove_extension, check_extension, file_digest
 from abc import ABC, abstractmethod
 
 
@@ -15,51 +20,130 @@ class Runner:
     ```shell
     java [security] [--enable-preview] -jar [jar_path] [options] -o [output] [input]
     ```
+
+    workers > 1 时测试用例会被并发执行, 每个用例仍然各自写出输出文件和状态文件.
+    给定 cache (ResultCache) 时, jar 和测试代码都没有变化的用例直接使用缓存结果, 不再启动 java.
+    给定 cds (CDSArchive) 时, 以 jar 的 CDS 归档启动虚拟机, 减少启动和类加载时间.
+    stdout 和 stderr 各自最多保留 max_output 字节, 超出部分以截断标记代替.
     """
 
-    def __init__(self, target, output_dir, output_extension, logger):
+    def __init__(self, target, output_dir, output_extension, logger, workers=1, cache=None, cds=None,
+                 max_output=DEFAULT_MAX_OUTPUT):
         self.target = target
         self.output_dir = output_dir
         self.output_extension = output_extension
         self.logger = logger
+        self.workers = workers
+        self.cache = cache
+        self.cds = cds
+        self.max_output = max_output
 
         policy_file = os.path.join(pathlib.Path(__file__).parent.absolute(), 'judge.policy')
         self.vm_args = ['--enable-preview', '-jar']
         # self.vm_args += ['-Djava.security.manager', '-Djava.security.policy=' + policy_file]
 
-    def _cmd_(self, app_path, app_args):
-        return ['java'] + self.vm_args + [app_path] + app_args
+    def _cmd_(self, app_path, app_args, limit=None, submission=None):
+        cds_args = self.cds.vm_args(app_path, app_args, limit=limit, submission=submission) \
+            if self.cds is not None else []
+        return ['java'] + cds_args + self.vm_args + [app_path] + app_args
 
     def run(self, jar_path, test_code_dir, out_dir):
-        # 测试文件文件路径
-        test_cases = listdirpath(test_code_dir, 'c')
+        # 测试文件文件路径, 排序以保证执行顺序和返回顺序确定
+        test_cases = sorted(listdirpath(test_code_dir, 'c'))
+
+        output_dir = self.prepare(out_dir)
+
+        if self.workers > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                list(executor.map(lambda test_case: self.run_single(jar_path, test_case, output_dir), test_cases))
+        else:
+            for test_case in test_cases:
+                self.run_single(jar_path, test_case, output_dir)
+        return output_dir
+
+    def _paths_(self, test_case, output_dir):
+        """:return: (输出文件路径, 状态文件路径)"""
+        base_name = remove_extension(os.path.basename(test_case))
+        return (os.path.join(output_dir, base_name + "." + self.output_extension),
+                os.path.join(output_dir, base_name + '.json'))
 
+    def prepare(self, out_dir):
+        """创建并返回本阶段的输出目录 out_dir/[output_dir]"""
         output_dir = os.path.join(out_dir, self.output_dir)
         os.makedirs(output_dir, exist_ok=True)
+        return output_dir
+
+    def run_single(self, jar_path, test_case, output_dir, timeout=DEFAULT_TIMEOUT, limit=None, submission=None):
+        """
+        执行单个测试用例, 输出写入 output_dir/[name].[ext], 状态写入 output_dir/[name].json.
+        缓存命中时使用缓存的结果 (cached), 否则执行 (execute_single)
+
+        :return: 状态字典
+        """
+        status = self.cached(jar_path, test_case, output_dir)
+        if status is not None:
+            return status
+        return self.execute_single(jar_path, test_case, output_dir, timeout, limit, submission)
 
-        for test_case in test_cases:
-            self.logger.info('processing ' + test_case)
-
-            base_name = remove_extension(os.path.basename(test_case))
-            app_args = [test_case, '--target', self.target, '-o',
-                        os.path.join(output_dir, base_name + "." + self.output_extension)]
-
-            p = subprocess.Popen(self._cmd_(jar_path, app_args), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE, shell=False)
-            try:
-                stdout, stderr = p.communicate(timeout=10)
-                status = {"return_code": p.returncode,
-                          "stdout": stdout.decode(encoding="utf-8", errors="strict"),
-                          "stderr": stderr.decode(encoding="utf-8", errors="strict")}
-            except subprocess.TimeoutExpired:
-                p.kill()
-                status = {"return_code": 1,
-                          "stdout": "",
-                          "stderr": "time out"}
-
-            with open(os.path.join(output_dir, base_name + '.json'), 'w') as f:
+    def cached(self, jar_path, test_case, output_dir):
+        """
+        查询结果缓存, 命中时把缓存的输出和状态写入 output_dir
+
+        :return: 缓存的状态字典, 没有缓存或未命中时返回None
+        """
+        if self.cache is None:
+            return None
+        output_path, status_path = self._paths_(test_case, output_dir)
+        status = self.cache.get(self.cache.key(jar_path, test_case, self.target, self.vm_args), output_path)
+        if status is not None:
+            self.logger.info('cache hit ' + test_case)
+            with open(status_path, 'w') as f:
                 json.dump(status, f)
-        return output_dir
+        return status
+
+    def execute_single(self, jar_path, test_case, output_dir, timeout=DEFAULT_TIMEOUT, limit=None, submission=None):
+        """
+        不查询缓存, 执行单个测试用例, 结果写入缓存
+
+        :param limit: 返回超时时间的函数 (如 TimeoutPolicy.limit), 给定时代替 timeout,
+                      在生成 CDS 归档的探测之后以 reserve=True 调用, 探测消耗的预算不会再给本次运行
+        :param submission: 生成 CDS 归档的探测耗时计入该提交
+
+        :return: 状态字典
+        """
+        output_path, status_path = self._paths_(test_case, output_dir)
+        cache_key = self.cache.key(jar_path, test_case, self.target, self.vm_args) if self.cache is not None else None
+
+        self.logger.info('processing ' + test_case)
+        app_args = [test_case, '--target', self.target, '-o', output_path]
+        # 删除上一次评测留下的输出, 以免把它当成本次的输出
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+        cmd = self._cmd_(jar_path, app_args, limit, submission)
+        if limit is not None:
+            timeout = limit(reserve=True)
+            if timeout <= 0:
+                # 预算已被生成 CDS 归档的探测耗尽
+                return {"return_code": 1, "stdout": "", "stderr": Grader.BUDGET_EXHAUSTED, "skipped": True}
+        execution = execute(cmd, timeout=timeout, max_output=self.max_output)
+        timed_out = execution.timed_out
+        if timed_out:
+            status = {"return_code": 1,
+                      "stdout": "",
+                      "stderr": "time out"}
+        else:
+            status = {"return_code": execution.return_code,
+                      "stdout": execution.stdout.decode(encoding="utf-8", errors="replace"),
+                      "stderr": execution.stderr.decode(encoding="utf-8", errors="replace")}
+        status["usage"] = execution.usage.to_dict()
+
+        with open(status_path, 'w') as f:
+            json.dump(status, f)
+        # 超时可能只是机器繁忙, 不缓存
+        if cache_key is not None and not timed_out:
+            self.cache.put(cache_key, output_path, status)
+        return status
 
 
 def listdirpath(path, ext):
@@ -79,48 +163,143 @@ def listdirpath(path, ext):
     return file_paths
 
 
+class Submission:
+    """
+    一份提交: jar 路径, 以及存放各阶段输出的目录 (默认为 jar 所在目录)
+    """
+
+    def __init__(self, path, out_dir=None):
+        self.path = path
+        self.out_dir = out_dir if out_dir is not None else os.path.dirname(path)
+        self.spent = 0.0  # 所有执行累计的墙上时间
+        # 正在执行的测试预留的时间 (TimeoutPolicy.limit): {(gold 目录, 测试名): 秒}
+        self.reserved = {}
+        # 快速失败 (FailFastPolicy) 的状态, 各阶段分别记录: {阶段: FailureState}
+        self.failures = {}
+        self.lock = threading.Lock()
+        self._key = None
+
+    def charge(self, seconds, reservation=None):
+        """计入耗时, 并释放 reservation 对应的预留"""
+        with self.lock:
+            self.spent += seconds
+            if reservation is not None:
+                self.reserved.pop(reservation, None)
+
+    @property
+    def key(self):
+        """提交的唯一标识: 路径和内容哈希, 同一路径下重新提交的 jar 视为不同的提交"""
+        if self._key is None:
+            self._key = os.path.abspath(self.path) + '@' + file_digest(self.path)
+        return self._key
+
+    def __str__(self):
+        return self.path
+
+
 class Grader(ABC):
-    def __init__(self, test_code_dir, test_gold_dir):
+    BUDGET_EXHAUSTED = "time budget exhausted"
+
+    def __init__(self, test_code_dir, test_gold_dir, workers=1, timeouts=None, fail_fast=None):
+        """
+        :param timeouts: 超时策略 (TimeoutPolicy), 默认每次执行 10 秒
+        :param fail_fast: 快速失败策略 (FailFastPolicy), None 表示总是执行所有测试
+        """
         self.test_code_dir = test_code_dir
         self.test_gold_dir = test_gold_dir
+        self.workers = workers
+        self.timeouts = timeouts if timeouts is not None else TimeoutPolicy()
+        self.fail_fast = fail_fast
 
-    @abstractmethod
     def grade(self, submitted_file):
+        check_extension(submitted_file, ('.jar', '.zip'))
+
+        with Scheduler(self.workers) as scheduler:
+            futures = [scheduler.submit(task) for task in self.tasks(Submission(submitted_file))]
+            return [future.result() for future in futures]
+
+    @abstractmethod
+    def tasks(self, submission) -> list:
+        """
+        把一份提交的评测拆分为 Task 列表, 报告顺序与列表顺序一致
+        """
         pass
 
 
 class BaseGrader(Grader):
-    def __init__(self, test_code_dir, test_gold_dir):
-        super().__init__(test_code_dir, test_gold_dir)
+    def __init__(self, test_code_dir, test_gold_dir, workers=1, cache=None, cds=None, timeouts=None,
+                 max_output=DEFAULT_MAX_OUTPUT, fail_fast=None):
+        super().__init__(test_code_dir, test_gold_dir, workers, timeouts, fail_fast)
         self.runner = self.get_runner()
+        self.runner.workers = workers
+        self.runner.cache = cache
+        self.runner.cds = cds
+        self.runner.max_output = max_output
 
-    def grade(self, submitted_file):
-        check_extension(submitted_file, ('.jar', '.zip'))
-
-        output_dir = os.path.dirname(submitted_file)
-        lex_out_dir = self.runner.run(submitted_file, self.test_code_dir, output_dir)
+    def tasks(self, submission):
+        output_dir = self.runner.prepare(submission.out_dir)
 
-        # Grade output
-        reports = []
-        for out_name in os.listdir(self.test_gold_dir):
+        tasks = []
+        for out_name in sorted(os.listdir(self.test_gold_dir)):
             if not out_name.endswith('.xml'):
                 continue
-            status = load_json(os.path.join(lex_out_dir, out_name[:-4] + '.json'))
-            msg = "stdout:\n{0}\n\nstderr:\n{1}".format(status['stdout'], status["stderr"])
-
-            # return code并不可靠, 即使return code=0不一定能保证stu_out_path, gold_out_path存在
-            stu_out_path = os.path.join(lex_out_dir, out_name)
-            gold_out_path = os.path.join(self.test_gold_dir, out_name)
-
-            try:
-                if os.path.exists(stu_out_path) and os.path.exists(gold_out_path):
-                    reports.append(self.grade_single(stu_out_path, gold_out_path))
-                else:
-                    reports.append(ErrorReport(out_name, BaseReport.TOTAL_GRADE, msg))
-            except Exception as e:
-                reports.append(ErrorReport(out_name, BaseReport.TOTAL_GRADE, msg + "\n\n" + str(e)))
-
-        return reports
+            test_case = os.path.join(self.test_code_dir, out_name[:-4] + '.c')
+            runs = []
+            if os.path.exists(test_case):
+                runs.append(functools.partial(self._run_, submission, test_case, output_dir))
+            grade = functools.partial(self._grade_output_, output_dir, out_name)
+            tasks.append(Task(self.runner.target, out_name[:-4], runs, grade))
+        return tasks
+
+    def _run_(self, submission, test_case, output_dir):
+        # 缓存的结果没有启动进程, 不受预算限制, 也不计入预算
+        status = self.runner.cached(submission.path, test_case, output_dir)
+        if status is None:
+            status = self._execute_(submission, test_case, output_dir)
+            if status.get('skipped'):
+                return status
+        if self.fail_fast is not None and status["stderr"] != "time out":
+            self.fail_fast.observe(submission, self.runner.target, test_case, status["return_code"], status["stderr"])
+        return status
+
+    def _execute_(self, submission, test_case, output_dir):
+        if self.fail_fast is not None:
+            failure = self.fail_fast.check(submission, self.runner.target)
+            if failure is not None:
+                return {"return_code": failure[0], "stdout": "", "stderr": failure[1], "skipped": True}
+
+        name = remove_extension(os.path.basename(test_case))
+        limit = functools.partial(self.timeouts.limit, submission, self.runner.target, self.test_gold_dir, name)
+        if limit() <= 0:
+            return {"return_code": 1, "stdout": "", "stderr": Grader.BUDGET_EXHAUSTED, "skipped": True}
+
+        status = self.runner.execute_single(submission.path, test_case, output_dir, limit=limit,
+                                            submission=submission)
+        usage = ResourceUsage.from_dict(status.get('usage'))
+        if usage is not None:
+            self.timeouts.charge(submission, self.test_gold_dir, name, usage)
+        return status
+
+    def _grade_output_(self, output_dir, out_name, statuses):
+        if not statuses:
+            return ErrorReport(out_name, BaseReport.TOTAL_GRADE, "test case of " + out_name + " not found")
+        status = statuses[0]
+        msg = "stdout:\n{0}\n\nstderr:\n{1}".format(status['stdout'], status["stderr"])
+
+        # return code并不可靠, 即使return code=0不一定能保证stu_out_path, gold_out_path存在
+        stu_out_path = os.path.join(output_dir, out_name)
+        gold_out_path = os.path.join(self.test_gold_dir, out_name)
+
+        try:
+            # skipped: 没有实际执行, 输出目录中可能是之前评测留下的文件
+            if not status.get('skipped') and os.path.exists(stu_out_path) and os.path.exists(gold_out_path):
+                report = self.grade_single(stu_out_path, gold_out_path)
+            else:
+                report = ErrorReport(out_name, BaseReport.TOTAL_GRADE, msg)
+        except Exception as e:
+            report = ErrorReport(out_name, BaseReport.TOTAL_GRADE, msg + "\n\n" + str(e))
+        report.usage = ResourceUsage.from_dict(status.get('usage'))
+        return report
 
     @abstractmethod
     def grade_single(self, stu_out, gold_out) -> BaseReport:
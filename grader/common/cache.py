@@ -0,0 +1,134 @@
+"""
+运行结果缓存
+
+学生程序的输出只取决于 jar, 测试代码, --target 和虚拟机参数, 因此以它们的哈希为键,
+缓存输出文件和状态文件, 命中时无需再启动 java.
+
+缓存目录结构:
+
+```
+cache_dir/
+    [key]/
+        status.json
+        output      (学生程序没有产生输出文件时不存在)
+```
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from hashlib import sha256
+
+from .util import file_digest
+
+
+class ResultCache:
+    STATUS_FILE = 'status.json'
+    OUTPUT_FILE = 'output'
+
+    def __init__(self, cache_dir, max_size=1 << 30):
+        """
+        :param cache_dir: 缓存目录, 可以在多次评测之间复用
+        :param max_size: 缓存总字节数上限, 超出时按最近最少使用淘汰
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> size, 按最近使用时间从旧到新排列
+        self._size = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        entries = []
+        for key in os.listdir(cache_dir):
+            entry_dir = os.path.join(cache_dir, key)
+            if key.startswith('.') or not os.path.isdir(entry_dir):
+                continue
+            entries.append((os.stat(entry_dir).st_mtime, key, _dir_size(entry_dir)))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._size += size
+
+    def key(self, jar_path, test_case, target, vm_args):
+        h = sha256()
+        for part in (file_digest(jar_path), file_digest(test_case), target, *vm_args):
+            h.update(part.encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def get(self, key, output_path):
+        """
+        查询缓存, 命中时把缓存的输出复制到 output_path
+
+        :return: 状态字典, 未命中返回None
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        try:
+            with open(os.path.join(entry_dir, self.STATUS_FILE), 'r') as f:
+                status = json.load(f)
+            cached_output = os.path.join(entry_dir, self.OUTPUT_FILE)
+            if os.path.exists(cached_output):
+                shutil.copyfile(cached_output, output_path)
+            elif os.path.exists(output_path):
+                os.remove(output_path)
+            os.utime(entry_dir)
+        except OSError:
+            # 条目被其他进程淘汰
+            with self._lock:
+                self.hits -= 1
+                self.misses += 1
+                self._forget(key)
+            return None
+        return status
+
+    def put(self, key, output_path, status):
+        tmp_dir = tempfile.mkdtemp(prefix='.', dir=self.cache_dir)
+        with open(os.path.join(tmp_dir, self.STATUS_FILE), 'w') as f:
+            json.dump(status, f)
+        if os.path.exists(output_path):
+            shutil.copyfile(output_path, os.path.join(tmp_dir, self.OUTPUT_FILE))
+        size = _dir_size(tmp_dir)
+
+        entry_dir = os.path.join(self.cache_dir, key)
+        with self._lock:
+            if key in self._entries:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                return
+            try:
+                os.rename(tmp_dir, entry_dir)
+            except OSError:
+                # 其他进程已写入同一个条目
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            self._entries[key] = size
+            self._size += size
+            self._evict()
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries), 'size': self._size}
+
+    def _evict(self):
+        while self._size > self.max_size and len(self._entries) > 1:
+            key, _ = next(iter(self._entries.items()))
+            self._forget(key)
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+    def _forget(self, key):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._size -= size
+
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
@@ -0,0 +1,149 @@
+"""
+AppCDS 归档缓存
+
+每个测试用例都会启动一次 JVM, 对于很小的测试代码, 启动和类加载占了大部分运行时间.
+每个 jar 第一次运行时以 -XX:ArchiveClassesAtExit 生成动态 CDS 归档, 之后的运行以
+-XX:SharedArchiveFile 复用. JVM 会校验归档记录的 jar 路径, 修改时间和大小, 任何一项不同都会拒绝归档,
+因此归档的键由 jar 的内容哈希, 绝对路径, 修改时间和大小共同决定:
+
+```
+archive_dir/
+    [key].jsa    归档
+    [key].json   生成记录: 启动时间节省 (秒) 或失败原因
+```
+
+使用归档时关闭 cds 日志: 归档被拒绝时 JVM 照常运行 (-Xshare:auto), 警告也不会混入学生程序的 stdout.
+
+归档生成失败时不再重试, 该 jar 的运行不带任何 CDS 参数.
+探测运行的超时时间与本次运行相同, 耗时计入提交的时间预算; 预算耗尽时不生成归档, 之后的运行可以再试.
+"""
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from hashlib import sha256
+
+from .util import file_digest
+
+logger = logging.getLogger("CDS Archive")
+
+# 使用归档时附加的参数, 归档不可用时静默地不使用
+SHARE_ARGS = ['-Xshare:auto', '-Xlog:cds=off,cds+dynamic=off']
+
+
+class CDSArchive:
+    PROBE_TIMEOUT = 10
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        self._lock = threading.Lock()
+        self._creating = set()
+        os.makedirs(archive_dir, exist_ok=True)
+
+    def vm_args(self, jar_path, probe_args, probe_input=None, limit=None, submission=None):
+        """
+        返回运行 jar_path 时需要附加的虚拟机参数
+
+        归档不存在时, 以 probe_args (和 probe_input 作为标准输入) 运行 jar 生成归档,
+        生成期间其他线程对同一 jar 的调用直接返回空参数, 不会等待.
+
+        :param limit: 无参函数, 每次探测前调用, 返回探测的超时时间, 通常为本次运行的 TimeoutPolicy.limit;
+                      返回 0 (预算已耗尽) 时放弃生成. None 表示使用 PROBE_TIMEOUT
+        :param submission: 探测的耗时计入该提交 (Submission.charge)
+        """
+        key = self._key_(jar_path)
+        archive_path = os.path.join(self.archive_dir, key + '.jsa')
+        record_path = os.path.join(self.archive_dir, key + '.json')
+
+        with self._lock:
+            if os.path.exists(record_path):
+                return _share_args(archive_path) if os.path.exists(archive_path) else []
+            if key in self._creating:
+                return []
+            self._creating.add(key)
+
+        try:
+            record = self._create_(jar_path, archive_path, probe_args, probe_input, limit, submission)
+            if record is not None:
+                with open(record_path, 'w') as f:
+                    json.dump(record, f)
+        finally:
+            with self._lock:
+                self._creating.discard(key)
+        return _share_args(archive_path) if os.path.exists(archive_path) else []
+
+    def record(self, jar_path):
+        """
+        :return: 归档生成记录, 包含 baseline (无归档启动耗时), archived (有归档启动耗时), saving (节省秒数)
+                 或 error (失败原因); 尚未生成时返回None
+        """
+        record_path = os.path.join(self.archive_dir, self._key_(jar_path) + '.json')
+        if not os.path.exists(record_path):
+            return None
+        with open(record_path, 'r') as f:
+            return json.load(f)
+
+    @staticmethod
+    def _key_(jar_path):
+        """归档的键: JVM 校验的路径, 修改时间和大小都相同, 内容也相同的 jar 才能共用归档"""
+        stat = os.stat(jar_path)
+        parts = (file_digest(jar_path), os.path.abspath(jar_path), str(stat.st_mtime_ns), str(stat.st_size))
+        return sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+    def _create_(self, jar_path, archive_path, probe_args, probe_input, limit, submission):
+        """:return: 生成记录, 预算耗尽而放弃时返回None"""
+        tmp_dir = tempfile.mkdtemp(prefix='.', dir=self.archive_dir)
+        tmp_archive = os.path.join(tmp_dir, 'app.jsa')
+
+        def probe(cds_args):
+            return self._probe_(cds_args, jar_path, probe_args, probe_input, tmp_dir, limit, submission)
+
+        try:
+            baseline = probe([])
+            probe(['-XX:ArchiveClassesAtExit=' + tmp_archive])
+            if not os.path.exists(tmp_archive):
+                raise RuntimeError('archive was not created')
+            archived = probe(_share_args(tmp_archive))
+            os.replace(tmp_archive, archive_path)
+            record = {"baseline": baseline, "archived": archived, "saving": baseline - archived}
+            logger.info('created CDS archive for {0}, startup saving {1:.3f}s'.format(jar_path, baseline - archived))
+        except _BudgetExhausted:
+            logger.info('time budget exhausted, skip creating CDS archive for {0}'.format(jar_path))
+            record = None
+        except (OSError, RuntimeError, subprocess.TimeoutExpired) as e:
+            record = {"error": str(e)}
+            logger.warning('can not create CDS archive for {0}: {1}'.format(jar_path, e))
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return record
+
+    def _probe_(self, cds_args, jar_path, probe_args, probe_input, tmp_dir, limit, submission):
+        """在 tmp_dir 中运行一次 jar, 输出文件参数 (-o) 重定向到 tmp_dir, 返回耗时"""
+        timeout = limit() if limit is not None else self.PROBE_TIMEOUT
+        if timeout <= 0:
+            raise _BudgetExhausted()
+        args = list(probe_args)
+        if '-o' in args:
+            args[args.index('-o') + 1] = os.path.join(tmp_dir, 'probe.out')
+        start = time.perf_counter()
+        try:
+            subprocess.run(['java'] + cds_args + ['--enable-preview', '-jar', jar_path] + args,
+                           input=probe_input.encode('utf-8') if probe_input is not None else b'',
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=timeout)
+        finally:
+            elapsed = time.perf_counter() - start
+            if submission is not None:
+                submission.charge(elapsed)
+        return elapsed
+
+
+def _share_args(archive_path):
+    return ['-XX:SharedArchiveFile=' + archive_path] + SHARE_ARGS
+
+
+class _BudgetExhausted(Exception):
+    pass
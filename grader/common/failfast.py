@@ -0,0 +1,88 @@
+"""
+快速失败策略
+
+没有主类, Java 版本不对或启动时就崩溃的 jar, 每次执行都会以同样的错误结束. 如果一份提交的前
+threshold 次执行都以相同的错误信息失败, 就认为它无法运行, 其余执行不再启动 JVM, 直接使用该错误.
+JVM 启动器的错误 (STARTUP_ERRORS) 足以判定; 其他错误可能只是某个测试程序触发的运行时错误,
+要来自 threshold 个不同的测试程序才判定, 同一程序的多个输入 (interpret) 只算一次.
+各阶段 (--target) 分别判定: 一个阶段无法运行不影响同一提交的其他阶段.
+"""
+import re
+
+
+# JVM 启动器报告的错误, 出现时学生程序根本没有运行
+STARTUP_ERRORS = (
+    'Could not find or load main class',
+    'UnsupportedClassVersionError',
+    'no main manifest attribute',
+    'Invalid or corrupt jarfile',
+)
+
+
+class FailFastPolicy:
+    SKIPPED_NOTE = "\n(not executed: the first {0} runs failed with the same error)"
+
+    def __init__(self, threshold=3):
+        self.threshold = threshold
+
+    def check(self, submission, stage):
+        """
+        :return: 判定为该阶段无法运行时返回 (return_code, stderr), 否则返回None
+        """
+        with submission.lock:
+            state = submission.failures.get(stage)
+            if state is not None and self._tripped_(state):
+                return_code, stderr = state.failure
+                return return_code, stderr + self.SKIPPED_NOTE.format(self.threshold)
+        return None
+
+    def observe(self, submission, stage, test_case, return_code, stderr):
+        """
+        记录该阶段一次执行的结果, 判定之前的执行都会被考虑
+
+        :param test_case: 测试程序的路径, 同一程序的多个输入传入相同的路径
+        """
+        signature = (return_code, self._normalize_(stderr, test_case))
+        with submission.lock:
+            state = submission.failures.setdefault(stage, FailureState())
+            if state.count < 0 or self._tripped_(state):
+                return
+            if return_code == 0 or stderr == '' or \
+                    (state.failure is not None and state.signature != signature):
+                # 出现成功的执行或不同的错误, 不再判定
+                state.count = -1
+                return
+            if state.failure is None:
+                state.failure = (return_code, stderr)
+                state.signature = signature
+                state.startup = any(error in stderr for error in STARTUP_ERRORS)
+            state.count += 1
+            state.programs.add(test_case)
+
+    def _tripped_(self, state):
+        if state.failure is None:
+            return False
+        if state.startup:
+            return state.count >= self.threshold
+        return len(state.programs) >= self.threshold
+
+    @staticmethod
+    def _normalize_(stderr, test_case):
+        """去掉与具体测试用例有关的部分: 测试用例路径和文件名"""
+        stderr = stderr.replace(test_case, '<test>')
+        basename = test_case.replace('\\', '/').split('/')[-1]
+        return re.sub(re.escape(basename), '<test>', stderr).strip()
+
+
+class FailureState:
+    """
+    一份提交在一个阶段的判定状态: 前几次执行共同的错误, 次数及出错的测试程序, 次数为 -1 表示不会再判定
+    """
+
+    def __init__(self):
+        self.failure = None
+        self.signature = None
+        # 是否为 JVM 启动器的错误
+        self.startup = False
+        self.count = 0
+        self.programs = set()
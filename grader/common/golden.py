@@ -0,0 +1,83 @@
+"""
+标准输出的预编译缓存
+
+每份提交都要重新解析同一批 gold 文件. compile_golden(path, compiler) 把 compiler(path) 的结果
+记在进程内, 设置了 CACHE_DIR 时还 pickle 到该目录中, 供其他评测进程直接读取.
+缓存以 gold 文件内容的 sha256 和 compiler 的名字为键, gold 文件变化后自动重新编译.
+
+compiler 返回的对象会被所有提交共享, 调用方不能修改它.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+
+from .util import file_digest
+
+# pickle 的内容格式变化时递增, 使旧的缓存文件失效
+FORMAT_VERSION = 4
+SUFFIX = '.pickle'
+# 缓存文件所在的目录 (grade.py --golden-cache), None 表示只缓存在内存中; 不会写入 gold 目录
+CACHE_DIR = None
+
+_memo = {}
+_memo_lock = threading.Lock()
+
+
+def compile_golden(path, compiler):
+    """返回 compiler(path), 结果缓存在内存和 CACHE_DIR 中"""
+    name = compiler.__module__ + '.' + compiler.__qualname__
+    digest = file_digest(path)
+    memo_key = (os.path.abspath(path), name)
+    with _memo_lock:
+        entry = _memo.get(memo_key)
+    if entry is not None and entry[0] == digest:
+        return entry[1]
+
+    data = _load(path, name, digest)
+    if data is None:
+        data = compiler(path)
+        _dump(path, name, digest, data)
+    with _memo_lock:
+        _memo[memo_key] = (digest, data)
+    return data
+
+
+def _cache_path(path):
+    """CACHE_DIR 中 path 的缓存文件, 文件名带上绝对路径的哈希, 不同目录下的同名 gold 文件互不覆盖"""
+    path = os.path.abspath(path)
+    prefix = hashlib.sha256(path.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, prefix + '-' + os.path.basename(path) + SUFFIX)
+
+
+def _load(path, name, digest):
+    if CACHE_DIR is None:
+        return None
+    try:
+        with open(_cache_path(path), 'rb') as f:
+            header = pickle.load(f)
+            if header != (FORMAT_VERSION, name, digest):
+                return None
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+
+
+def _dump(path, name, digest, data):
+    if CACHE_DIR is None:
+        return
+    # 缓存目录不可写时只缓存在内存中
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, prefix='.golden-')
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((FORMAT_VERSION, name, digest), f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, _cache_path(path))
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
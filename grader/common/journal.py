@@ -0,0 +1,76 @@
+"""
+评测日志
+
+以 SQLite 记录每个已完成的评测单元 (提交, 阶段, 测试用例) 及其报告内容.
+评测中断 (OOM, 重启, Ctrl-C) 后以同一个日志重新评测, 已完成的单元直接读取记录, 只调度剩余部分.
+"""
+import io
+import sqlite3
+import threading
+import time
+
+from .report import BaseReport
+
+
+class Journal:
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS units ('
+                           'submission TEXT, stage TEXT, test TEXT, '
+                           'report_name TEXT, total_grade INTEGER, grade INTEGER, detail TEXT, finished REAL, '
+                           'PRIMARY KEY (submission, stage, test))')
+
+    def get(self, submission, stage, test):
+        """
+        :return: 已记录的报告 (RecordedReport), 没有记录时返回None
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT report_name, total_grade, grade, detail FROM units '
+                                     'WHERE submission=? AND stage=? AND test=?',
+                                     (submission, stage, test)).fetchone()
+        return RecordedReport(*row) if row is not None else None
+
+    def record(self, submission, stage, test, report):
+        # 用 write_detail 写出, 不访问 report.detail, 避免报告缓存一份完整的详情
+        detail = io.StringIO()
+        report.write_detail(detail)
+        row = (submission, stage, test, report.report_name, report.total_grade, report.grade, detail.getvalue(),
+               time.time())
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO units VALUES (?, ?, ?, ?, ?, ?, ?, ?)', row)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RecordedReport(BaseReport):
+    """
+    从日志恢复的报告, 只保留名称, 分数和详情
+    """
+
+    def __init__(self, report_name, total_grade, grade, detail):
+        self._report_name = report_name
+        self._total_grade = total_grade
+        self._grade = grade
+        self._detail = detail
+
+    @property
+    def report_name(self):
+        return self._report_name
+
+    @property
+    def total_grade(self):
+        return self._total_grade
+
+    @property
+    def grade(self):
+        return self._grade
+
+    @property
+    def detail(self):
+        return self._detail
@@ -2,57 +2,257 @@
 求解最长公共子序列
 
 ref:http://wordaligned.org/articles/longest-common-subsequence
+
+元素先按 key 映射为整数编号, 再用位并行算法 (Allison-Dix / Hyyrö) 逐行计算: xs 的每个位置是
+一个比特, 一行 DP 只需要几次大整数运算. 每行以一个整数保存 "长度在此处加一" 的位置, 回溯时
+只需要测试比特, 因此表格只占 len(xs) * len(ys) / 8 字节. 表格超过 MAX_TABLE_BYTES 时只保存
+若干行作为检查点, 回溯时逐段重新计算 (_lcs_checkpoint), 结果与完整的表格相同.
+
+ref: L. Allison, T.I. Dix. A bit-string longest-common-subsequence algorithm. 1986
+ref: H. Hyyrö. Bit-parallel LCS-length computation revisited. 2004
 """
 
-from collections import defaultdict, namedtuple
-from itertools import product
-
-
-def lcs_grid(xs, ys, eq):
-    """Create a grid for longest common subsequence calculations.
-    
-    Returns a grid where grid[(j, i)] is a pair (n, move) such that
-    - n is the length of the LCS of prefixes xs[:i], ys[:j]
-    - move is \, ^, <, or e, depending on whether the best move
-      to (j, i) was diagonal, downwards, or rightwards, or None.
-    
-    Example:
-       T  A  R  O  T
-    A 0< 1\ 1< 1< 1<
-    R 0< 1^ 2\ 2< 2<
-    T 1\ 1< 2^ 2< 3\
-    """
-    Cell = namedtuple('Cell', 'length move')
-    grid = defaultdict(lambda: Cell(0, 'e'))
-    sqs = product(enumerate(ys), enumerate(xs))
-    for (j, y), (i, x) in sqs:
-        if eq(x, y):
-            cell = Cell(grid[(j - 1, i - 1)].length + 1, '\\')
+MAX_TABLE_BYTES = 64 << 20
+MYERS_MAX_D = 512
+
+
+def lcs(xs, ys, eq=None, key=None):
+    """Return a longest common subsequence of xs, ys.
+
+    结果为 [(i, j), ...], 表示 xs[i] 与 ys[j] 匹配, i 和 j 均严格递增.
+
+    :param eq: 自定义相等判断 eq(x, y), 无法预先编号, 较慢, 优先使用 key
+    :param key: 元素按 key(item) 比较, 默认比较元素本身 (需可哈希)
+    """
+    if eq is not None:
+        # 无法编号, 每个 ys 元素单独计算匹配位向量
+        positions = {j: _mask_by_eq(xs, y, eq) for j, y in enumerate(ys)}
+        ys_ids = range(len(ys))
+    else:
+        xs_ids, ys_ids = intern(xs, ys, key)
+        positions = {}
+        for i, x in enumerate(xs_ids):
+            positions[x] = positions.get(x, 0) | (1 << i)
+
+    if len(xs) * len(ys) // 8 <= MAX_TABLE_BYTES:
+        return _lcs_table(len(xs), [positions.get(y, 0) for y in ys_ids], 0, 0)
+    return _lcs_checkpoint(len(xs), positions, ys_ids)
+
+
+def myers(xs, ys, key=None, max_d=MYERS_MAX_D):
+    """与 lcs 结果完全相同, 但耗时与差异数 D 成正比: O((N + M) * D).
+
+    先去掉相同的前缀和后缀, 再用 Myers 算法记录从左上角出发、每个编辑次数能到达的最远位置.
+    同一对角线上编辑距离单调不减, 因此回溯时可以直接判断某个格子是否仍在最优路径上,
+    从而沿用 lcs 的回溯规则. 差异数超过 max_d 时退回 lcs.
+
+    ref: E. W. Myers. An O(ND) difference algorithm and its variations. 1986
+    """
+    xs_ids, ys_ids = intern(xs, ys, key)
+    return myers_ids(xs_ids, ys_ids, max_d)
+
+
+def myers_ids(xs_ids, ys_ids, max_d=MYERS_MAX_D):
+    """同 myers, 但参数是已经编号的序列 (见 intern, intern_with)"""
+    n, m = len(xs_ids), len(ys_ids)
+    prefix = _common_prefix(xs_ids, ys_ids)
+    suffix = _common_suffix(xs_ids, ys_ids, min(n, m) - prefix)
+
+    trace = _myers_trace(xs_ids[prefix:n - suffix], ys_ids[prefix:m - suffix], max_d)
+    if trace is None:
+        return lcs(xs_ids, ys_ids)
+
+    def reachable(i, j, d):
+        """xs[:i] 与 ys[:j] 的编辑距离是否不超过 d"""
+        if i <= prefix or j <= prefix:
+            # 其中一个是公共前缀的前缀
+            return abs(i - j) <= d
+        k = i - j
+        if abs(k) > d:
+            return False
+        return i - prefix <= trace[d][(k + d) // 2]
+
+    result = [(n - t - 1, m - t - 1) for t in range(suffix)]
+    i, j = n - suffix, m - suffix
+    remaining = len(trace) - 1
+    while i > 0 and j > 0:
+        if xs_ids[i - 1] == ys_ids[j - 1]:
+            result.append((i - 1, j - 1))
+            i -= 1
+            j -= 1
+        elif reachable(i - 1, j, remaining - 1):
+            i -= 1
+            remaining -= 1
         else:
-            left = grid[(j, i - 1)].length
-            over = grid[(j - 1, i)].length
-            if left < over:
-                cell = Cell(over, '^')
+            j -= 1
+            remaining -= 1
+    result.reverse()
+    return result
+
+
+def _common_prefix(xs, ys):
+    """xs 与 ys 公共前缀的长度. 二分查找, 每次用切片比较一段, 比较在 C 中完成"""
+    low, high = 0, min(len(xs), len(ys))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if xs[low:mid] == ys[low:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def _common_suffix(xs, ys, limit):
+    """xs 与 ys 公共后缀的长度, 不超过 limit"""
+    n, m = len(xs), len(ys)
+    low, high = 0, limit
+    while low < high:
+        mid = (low + high + 1) // 2
+        if xs[n - mid:n - low] == ys[m - mid:m - low]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def _myers_trace(xs, ys, max_d):
+    """
+    返回 trace, trace[d][(k + d) // 2] 为编辑 d 次能在对角线 k = i - j 上到达的最远 i,
+    无法到达时为 -1. 编辑距离超过 max_d 时返回 None.
+    """
+    n, m = len(xs), len(ys)
+    trace = []
+    previous = None
+    for d in range(min(max_d, n + m) + 1):
+        row = [-1] * (d + 1)
+        for k in range(-d, d + 1, 2):
+            if d == 0:
+                i = 0
             else:
-                cell = Cell(left, '<')
-        grid[(j, i)] = cell
-    return grid
-
-
-def lcs(xs, ys, eq=lambda x, y: x == y):
-    """Return a longest common subsequence of xs, ys."""
-    # Create the LCS grid, then walk back from the bottom right corner
-    grid = lcs_grid(xs, ys, eq)
-    i, j = len(xs) - 1, len(ys) - 1
-    lcs = list()
-    for move in iter(lambda: grid[(j, i)].move, 'e'):
-        if move == '\\':
-            lcs.append((i, j))
+                # 从对角线 k + 1 跳过 ys 的一个元素, 或从 k - 1 跳过 xs 的一个元素
+                down = previous[(k + d) // 2] if k < d else -1
+                if down - k > m:
+                    down = -1
+                right = previous[(k + d) // 2 - 1] if k > -d else -1
+                right = right + 1 if 0 <= right < n else -1
+                i = max(down, right)
+                if i < 0:
+                    continue
+            j = i - k
+            while i < n and j < m and xs[i] == ys[j]:
+                i += 1
+                j += 1
+            row[(k + d) // 2] = i
+        trace.append(row)
+        if abs(n - m) <= d and (n - m + d) % 2 == 0 and row[(n - m + d) // 2] == n:
+            return trace
+        previous = row
+    return None
+
+
+def intern(xs, ys, key=None):
+    """把元素 (或 key(元素)) 映射为从 0 开始的整数编号, 相等的元素编号相同"""
+    ids = {}
+    if key is None:
+        xs_ids = [ids.setdefault(x, len(ids)) for x in xs]
+        ys_ids = [ids.setdefault(y, len(ids)) for y in ys]
+    else:
+        xs_ids = [ids.setdefault(key(x), len(ids)) for x in xs]
+        ys_ids = [ids.setdefault(key(y), len(ids)) for y in ys]
+    return xs_ids, ys_ids
+
+
+def intern_with(ids, xs, key=None):
+    """按已有的编号表 ids 为 xs 编号, 不修改 ids; ids 中没有的元素编号为负数.
+
+    适合同一个序列 (ids 由它得到) 与许多序列比较的情况, 它只需编号一次.
+    """
+    extra = {}
+    result = []
+    for x in xs if key is None else map(key, xs):
+        number = ids.get(x)
+        if number is None:
+            number = extra.setdefault(x, -1 - len(extra))
+        result.append(number)
+    return result
+
+
+def _mask_by_eq(xs, y, eq):
+    mask = 0
+    for i, x in enumerate(xs):
+        if eq(x, y):
+            mask |= 1 << i
+    return mask
+
+
+def _rows(n, masks, v=None):
+    """
+    逐行计算位向量 V_j: 第 i 位为 0 当且仅当 L(j, i) = L(j, i - 1) + 1,
+    其中 L(j, i) 为 xs[:i + 1] 与 ys[:j + 1] 的LCS长度
+
+    :param v: 上一行的位向量, 从中间某行继续计算时给出
+    """
+    full = (1 << n) - 1
+    v = full if v is None else v
+    for m in masks:
+        u = v & m
+        v = ((v + u) | (v - u)) & full
+        yield v
+
+
+def _lcs_table(n, masks, x_offset, y_offset):
+    """
+    保存每一行的位向量, 再从右下角回溯. 回溯规则与原先逐格计算的表格一致:
+    相等时走对角线; 否则若 L(j, i - 1) < L(j - 1, i) (即本行在 i 处加一) 向上, 否则向左.
+    """
+    rows = list(_rows(n, masks))
+    i, j = n - 1, len(masks) - 1
+    result = []
+    while i >= 0 and j >= 0:
+        if (masks[j] >> i) & 1:
+            result.append((i + x_offset, j + y_offset))
             i -= 1
             j -= 1
-        elif move == '^':
+        elif not (rows[j] >> i) & 1:
             j -= 1
-        elif move == '<':
+        else:
             i -= 1
-    lcs.reverse()
-    return lcs
+    result.reverse()
+    return result
+
+
+def _lcs_checkpoint(n, positions, ys_ids):
+    """
+    与 _lcs_table 结果相同, 但只保存每 chunk 行开始前的位向量 (检查点). 回溯时从最后一段开始,
+    由检查点重新计算该段的各行再回溯, 每段的表格不超过 MAX_TABLE_BYTES, 总耗时约为两遍正向计算.
+    """
+    m = len(ys_ids)
+    chunk = max(1, MAX_TABLE_BYTES * 8 // max(n, 1))
+
+    def masks(start, stop):
+        return [positions.get(ys_ids[j], 0) for j in range(start, stop)]
+
+    checkpoints = []
+    v = (1 << n) - 1
+    for start in range(0, m, chunk):
+        checkpoints.append(v)
+        for v in _rows(n, masks(start, min(start + chunk, m)), v):
+            pass
+
+    i, j = n - 1, m - 1
+    result = []
+    while checkpoints and i >= 0 and j >= 0:
+        start = (len(checkpoints) - 1) * chunk
+        segment = masks(start, j + 1)
+        rows = list(_rows(n, segment, checkpoints.pop()))
+        while i >= 0 and j >= start:
+            if (segment[j - start] >> i) & 1:
+                result.append((i, j))
+                i -= 1
+                j -= 1
+            elif not (rows[j - start] >> i) & 1:
+                j -= 1
+            else:
+                i -= 1
+    result.reverse()
+    return result
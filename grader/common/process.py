@@ -0,0 +1,195 @@
+"""
+执行子进程并统计其资源占用
+
+与 subprocess.Popen.communicate 不同, 这里以 os.wait4 回收子进程, 从而得到该子进程自身的
+CPU 时间和峰值内存, 即使多个子进程在不同线程中并发执行也互不干扰.
+
+子进程的 stdout 和 stderr 边读边丢弃超出上限的部分, 只保留开头和结尾各一半, 因此无论子进程
+输出多少, 每次执行占用的内存都有上限. 调用方还可以逐块检查 stdout, 确定结果后提前杀死子进程.
+"""
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+
+class ResourceUsage:
+
+    def __init__(self, wall_time=0.0, user_time=0.0, sys_time=0.0, max_rss=0):
+        """
+        :param wall_time: 墙上时间 (秒)
+        :param user_time: 用户态 CPU 时间 (秒)
+        :param sys_time: 内核态 CPU 时间 (秒)
+        :param max_rss: 峰值常驻内存 (字节)
+        """
+        self.wall_time = wall_time
+        self.user_time = user_time
+        self.sys_time = sys_time
+        self.max_rss = max_rss
+
+    @staticmethod
+    def from_rusage(wall_time, rusage):
+        # Linux 上 ru_maxrss 的单位是 KB, macOS 上是字节
+        max_rss = rusage.ru_maxrss if sys.platform == 'darwin' else rusage.ru_maxrss * 1024
+        return ResourceUsage(wall_time, rusage.ru_utime, rusage.ru_stime, max_rss)
+
+    @staticmethod
+    def from_dict(data):
+        """从状态文件中的 usage 字段恢复, 没有记录时返回None"""
+        if data is None:
+            return None
+        return ResourceUsage(data['wall_time'], data['user_time'], data['sys_time'], data['max_rss'])
+
+    def to_dict(self):
+        return {"wall_time": self.wall_time,
+                "user_time": self.user_time,
+                "sys_time": self.sys_time,
+                "max_rss": self.max_rss}
+
+    def __add__(self, other):
+        """累加多次执行: 时间求和, 峰值内存取最大"""
+        if other is None:
+            return self
+        return ResourceUsage(self.wall_time + other.wall_time,
+                             self.user_time + other.user_time,
+                             self.sys_time + other.sys_time,
+                             max(self.max_rss, other.max_rss))
+
+    __radd__ = __add__
+
+    def __str__(self):
+        return "wall={0:.3f}s, user={1:.3f}s, sys={2:.3f}s, rss={3:.1f}MB".format(
+            self.wall_time, self.user_time, self.sys_time, self.max_rss / (1 << 20))
+
+
+DEFAULT_MAX_OUTPUT = 1 << 20
+
+
+class BoundedBuffer:
+    """
+    保留前 limit/2 和后 limit/2 字节, 中间被丢弃的部分以截断标记代替
+    """
+
+    def __init__(self, limit):
+        self.head_limit = limit // 2
+        self.tail_limit = limit - self.head_limit
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+
+    def write(self, chunk):
+        self.total += len(chunk)
+        if len(self.head) < self.head_limit:
+            n = self.head_limit - len(self.head)
+            self.head += chunk[:n]
+            chunk = chunk[n:]
+        if chunk:
+            self.tail += chunk[-self.tail_limit:] if self.tail_limit else b''
+            if len(self.tail) > self.tail_limit:
+                del self.tail[:len(self.tail) - self.tail_limit]
+
+    @property
+    def truncated(self):
+        return self.total - len(self.head) - len(self.tail)
+
+    def getvalue(self):
+        if self.truncated == 0:
+            return bytes(self.head + self.tail)
+        marker = "\n... [truncated {0} bytes] ...\n".format(self.truncated).encode('utf-8')
+        return bytes(self.head) + marker + bytes(self.tail)
+
+
+class Execution:
+    """一次执行的结果, stdout 和 stderr 为原始字节"""
+
+    def __init__(self, return_code, stdout, stderr, timed_out, usage, stopped=False):
+        self.return_code = return_code
+        self.stdout = stdout
+        self.stderr = stderr
+        self.timed_out = timed_out
+        self.usage = usage
+        # 被 on_stdout 提前终止
+        self.stopped = stopped
+
+
+def execute(cmd, input_data=None, timeout=10, max_output=DEFAULT_MAX_OUTPUT, on_stdout=None) -> Execution:
+    """
+    执行 cmd 并等待其结束, 超时后杀死子进程
+
+    :param input_data: 写入标准输入的字节, None 表示不写入任何内容
+    :param max_output: stdout 和 stderr 各自最多保留的字节数
+    :param on_stdout: 以读到的每块 stdout 为参数在读取线程中调用, 返回 False 时杀死子进程
+    """
+    start = time.perf_counter()
+    p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=False)
+
+    lock = threading.Lock()
+    state = {'exited': False, 'timed_out': False, 'stopped': False}
+
+    def kill(reason):
+        with lock:
+            if not state['exited'] and not state['timed_out'] and not state['stopped']:
+                state[reason] = True
+                # 不用 p.kill(): 它会先 poll(), 回收已经退出的子进程, 之后的 waitid 随之失败
+                os.kill(p.pid, signal.SIGKILL)
+
+    stdout, stderr = BoundedBuffer(max_output), BoundedBuffer(max_output)
+    if on_stdout is not None:
+        stdout = _Watched(stdout, on_stdout, lambda: kill('stopped'))
+    threads = [threading.Thread(target=_read_, args=(p.stdout, stdout), daemon=True),
+               threading.Thread(target=_read_, args=(p.stderr, stderr), daemon=True),
+               threading.Thread(target=_write_, args=(p.stdin, input_data), daemon=True)]
+    for thread in threads:
+        thread.start()
+
+    timer = threading.Timer(timeout, kill, args=('timed_out',))
+    timer.start()
+    # 先等待退出但不回收, 确保 kill 不会作用于已回收 (pid 可能已被复用) 的进程
+    os.waitid(os.P_PID, p.pid, os.WEXITED | os.WNOWAIT)
+    with lock:
+        state['exited'] = True
+    timer.cancel()
+    _, wait_status, rusage = os.wait4(p.pid, 0)
+    p.returncode = os.waitstatus_to_exitcode(wait_status)
+    wall_time = time.perf_counter() - start
+
+    for thread in threads:
+        thread.join()
+    return Execution(p.returncode, stdout.getvalue(), stderr.getvalue(), state['timed_out'],
+                     ResourceUsage.from_rusage(wall_time, rusage), state['stopped'])
+
+
+class _Watched:
+    """写入 buffer 的同时交给 callback 检查, callback 返回 False 时调用 stop (只调用一次)"""
+
+    def __init__(self, buffer, callback, stop):
+        self.buffer = buffer
+        self.callback = callback
+        self.stop = stop
+        self.stopped = False
+
+    def write(self, chunk):
+        self.buffer.write(chunk)
+        if not self.stopped and self.callback(chunk) is False:
+            self.stopped = True
+            self.stop()
+
+    def getvalue(self):
+        return self.buffer.getvalue()
+
+
+def _read_(stream, buffer):
+    with stream:
+        for chunk in iter(lambda: stream.read1(1 << 16), b''):
+            buffer.write(chunk)
+
+
+def _write_(stream, data):
+    try:
+        with stream:
+            if data:
+                stream.write(data)
+    except BrokenPipeError:
+        pass
@@ -0,0 +1,33 @@
+"""
+报告模板渲染
+
+所有报告共用一个 jinja2 Environment, 模板路径相对于 grader 包, 例如 'lex/report.html'.
+模板只编译一次并缓存在内存中; use_bytecode_cache 可以把编译结果保存到磁盘, 供之后的评测进程复用.
+stream 逐段写出渲染结果, 不生成完整的字符串.
+"""
+import os
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+TEMPLATE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 模板随包发布, 不会在评测过程中修改, 因此关闭 auto_reload
+environment = Environment(loader=FileSystemLoader(TEMPLATE_ROOT),
+                          lstrip_blocks=True,
+                          trim_blocks=True,
+                          auto_reload=False)
+
+
+def use_bytecode_cache(cache_dir):
+    os.makedirs(cache_dir, exist_ok=True)
+    environment.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+
+def render(template_name, **context):
+    return environment.get_template(template_name).render(**context)
+
+
+def stream(out, template_name, **context):
+    """渲染并逐段写入 out (有 write 方法的对象)"""
+    for chunk in environment.get_template(template_name).generate(**context):
+        out.write(chunk)
@@ -4,6 +4,9 @@ from abc import ABC, abstractmethod
 class BaseReport(ABC):
     TOTAL_GRADE = 100
 
+    # 学生程序的资源占用 (ResourceUsage), 多次执行时为累计值, 未知时为None
+    usage = None
+
     @property
     @abstractmethod
     def report_name(self):
@@ -24,6 +27,10 @@ class BaseReport(ABC):
     def detail(self):
         pass
 
+    def write_detail(self, out):
+        """把 detail 写入 out, 报告很大时子类可以逐段写出, 不生成完整字符串"""
+        out.write(self.detail)
+
 
 class ErrorReport(BaseReport):
 
@@ -0,0 +1,113 @@
+"""
+评测任务调度
+
+每个 Task 由若干次程序执行 (runs) 和一次评分 (grade) 组成, 构成一个两层的依赖图:
+同一任务的全部执行完成后才会评分. 所有任务共享同一个线程池, 线程数即全局并发上限.
+"""
+import threading
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+
+
+class Task:
+
+    def __init__(self, stage, name, runs, grade):
+        """
+        :param stage: 评测阶段, 如 lex, parse, interpret
+        :param name: 测试用例名
+        :param runs: 无参函数列表, 每个函数执行一次程序并返回结果, 可以并发执行
+        :param grade: 以 runs 的结果列表 (与 runs 顺序一致) 为参数, 返回评测报告
+        """
+        self.stage = stage
+        self.name = name
+        self.runs = runs
+        self.grade = grade
+
+    def __str__(self):
+        return "Task({0}, {1})".format(self.stage, self.name)
+
+
+class Scheduler:
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def submit(self, task) -> Future:
+        """
+        提交一个任务, 返回评测报告的 Future
+
+        评分在完成最后一次执行的工作线程中进行, 因此同样受并发上限约束.
+        """
+        report = Future()
+        results = [None] * len(task.runs)
+        remaining = [len(task.runs)]
+        lock = threading.Lock()
+
+        def grade():
+            try:
+                report.set_result(task.grade(results))
+            except Exception as e:
+                report.set_exception(e)
+
+        def on_done(index, run_future):
+            error = CancelledError() if run_future.cancelled() else run_future.exception()
+            with lock:
+                if remaining[0] < 0:
+                    return
+                if error is not None:
+                    remaining[0] = -1
+                else:
+                    results[index] = run_future.result()
+                    remaining[0] -= 1
+                    if remaining[0] > 0:
+                        return
+            if error is not None:
+                report.set_exception(error)
+            else:
+                grade()
+
+        if not task.runs:
+            self.executor.submit(grade)
+        for index, run in enumerate(task.runs):
+            run_future = self.executor.submit(run)
+            run_future.add_done_callback(lambda f, index=index: on_done(index, f))
+        return report
+
+    def shutdown(self, cancel=False):
+        """
+        :param cancel: 取消尚未开始的执行, 如评测被中断时
+        """
+        self.executor.shutdown(wait=True, cancel_futures=cancel)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(cancel=exc_type is not None)
+
+
+def gather(futures) -> Future:
+    """
+    返回一个在所有 futures 完成后完成的 Future, 结果为各 future 结果的列表 (顺序不变)
+    """
+    result = Future()
+    futures = list(futures)
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] != 0:
+                return
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors:
+            result.set_exception(errors[0])
+        else:
+            result.set_result([future.result() for future in futures])
+
+    if not futures:
+        result.set_result([])
+    for future in futures:
+        future.add_done_callback(on_done)
+    return result
@@ -0,0 +1,34 @@
+"""
+XML 流式读取
+
+学生程序的输出可能很大, ET.parse 会把整棵树读入内存, 按 tag 多次 iter 又要遍历多遍.
+iter_elements 用 iterparse 只读一遍, 按文档顺序给出感兴趣的元素, 调用方处理完后立即从树中删除.
+"""
+from xml.etree.ElementTree import iterparse
+
+
+def iter_elements(source, tags):
+    """按文档顺序生成 tag 属于 tags 的元素 (任意深度)
+
+    生成时元素及其子元素已完整解析, 可以用 findtext 等读取; 继续迭代后该元素即被删除,
+    调用方不应再持有它. 不在这些元素内部的其他元素读完即删除, 内存只与单个元素的大小有关.
+
+    :param source: 文件名或文件对象
+    :param tags: 元素的 tag 集合
+    """
+    tags = frozenset(tags)
+    path = []
+    # 当前位于多少个目标元素内部, 目标元素内部的子元素在目标元素结束前需要保留
+    inside = 0
+    for event, element in iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            path.append(element)
+            if element.tag in tags:
+                inside += 1
+            continue
+        path.pop()
+        if element.tag in tags:
+            inside -= 1
+            yield element
+        if inside == 0 and path:
+            path[-1].remove(element)
@@ -0,0 +1,98 @@
+"""
+超时策略
+
+每个测试的超时时间由参考解的实测耗时推导: factor * 参考耗时 + margin (JVM启动余量).
+参考耗时保存在各阶段 gold 目录下的 timing.json 中 ({测试名: 秒}), 以 calibrate=True 的策略
+评测参考解即可生成. 没有参考耗时的测试使用 default.
+
+此外每份提交有一个总时间预算, 预算耗尽后剩余的执行直接判为超时, 不再占用工作线程.
+执行开始时为它预留超时时间, 结束时按实际耗时结算, 并发的执行合计也不会超出预算.
+"""
+import json
+import os
+import threading
+
+DEFAULT_TIMEOUT = 10
+
+
+class TimeoutPolicy:
+    TIMING_FILE = 'timing.json'
+
+    def __init__(self, factor=3.0, margin=2.0, default=DEFAULT_TIMEOUT, overrides=None, budget=None,
+                 calibrate=False):
+        """
+        :param factor: 参考耗时的倍数
+        :param margin: 在倍数之外额外给出的秒数
+        :param default: 没有参考耗时时的超时时间
+        :param overrides: {阶段: 秒}, 如 {'interpret': 5}, 覆盖该阶段所有测试的超时时间
+        :param budget: 每份提交所有执行的总墙上时间上限 (秒), None 表示不限
+        :param calibrate: 校准模式: 以 default 为超时时间, 记录每个测试的实际耗时, 由 save() 写入 timing.json
+        """
+        self.factor = factor
+        self.margin = margin
+        self.default = default
+        self.overrides = overrides or {}
+        self.budget = budget
+        self.calibrate = calibrate
+        self._lock = threading.Lock()
+        self._timings = {}
+        self._observed = {}
+
+    def timeout(self, stage, gold_dir, name):
+        if stage in self.overrides:
+            return self.overrides[stage]
+        if self.calibrate:
+            return self.default
+        reference = self._load_(gold_dir).get(name)
+        if reference is None:
+            return self.default
+        return self.factor * reference + self.margin
+
+    def limit(self, submission, stage, gold_dir, name, reserve=False):
+        """
+        :param reserve: 从预算中为本次执行预留返回的时间, 由 charge 结算
+        :return: 本次执行的超时时间, 不超过提交剩余 (减去正在执行的预留) 的预算; 预算已耗尽时返回 0
+        """
+        timeout = self.timeout(stage, gold_dir, name)
+        if self.budget is None:
+            return timeout
+        with submission.lock:
+            timeout = max(0, min(timeout, self.budget - submission.spent - sum(submission.reserved.values())))
+            if reserve and timeout > 0:
+                submission.reserved[(gold_dir, name)] = timeout
+        return timeout
+
+    def charge(self, submission, gold_dir, name, usage):
+        """记录一次执行的耗时, 释放它的预留"""
+        submission.charge(usage.wall_time, (gold_dir, name))
+        if self.calibrate:
+            with self._lock:
+                observed = self._observed.setdefault(gold_dir, {})
+                observed[name] = max(observed.get(name, 0), usage.wall_time)
+
+    def save(self):
+        """把校准模式下记录的耗时合并写入各 gold 目录的 timing.json"""
+        with self._lock:
+            for gold_dir, observed in self._observed.items():
+                timings = dict(self._timings_of_(gold_dir))
+                timings.update(observed)
+                os.makedirs(gold_dir, exist_ok=True)
+                with open(os.path.join(gold_dir, self.TIMING_FILE), 'w') as f:
+                    json.dump(timings, f, indent=4, sort_keys=True)
+                self._timings[gold_dir] = timings
+
+    def _load_(self, gold_dir):
+        with self._lock:
+            return self._timings_of_(gold_dir)
+
+    def _timings_of_(self, gold_dir):
+        """读取 (并缓存) gold_dir 的参考耗时, 调用方需持有 self._lock"""
+        timings = self._timings.get(gold_dir)
+        if timings is None:
+            path = os.path.join(gold_dir, self.TIMING_FILE)
+            timings = {}
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    timings = json.load(f)
+            self._timings[gold_dir] = timings
+        return timings
@@ -0,0 +1,227 @@
+"""
+XML 树的规范化哈希与比较
+
+两棵树哈希相同时 xmldiff 一定不会报告差异, 可以跳过 diff. 规范化规则与 xmldiff 一致:
+属性与顺序无关; 有子节点的元素中只含空白的 text, 以及只含空白的 tail 被忽略; 其余文本逐字比较.
+
+每个子树的哈希由子节点的哈希组合而成 (Merkle 树), 因此可以从根开始逐层找到真正不同的最小子树,
+只在那里运行一次 xmldiff. 子树的 diff 只有更新文本和属性时才与整棵树的 diff 相同: 插入或删除的节点
+可能与子树之外的节点匹配, 整棵树的 diff 会报告为 move, 这时仍然比较整棵树.
+
+xmldiff 的匹配在节点很多时非常慢. 差异部分的节点数超过 MAX_DIFF_NODES, 或者 xmldiff 运行超过
+MAX_DIFF_SECONDS 秒时, 改用自顶向下的哈希匹配 (_approximate_diff), 结果标记为近似.
+"""
+import time
+from copy import deepcopy
+from hashlib import sha256
+
+from lxml import etree
+from xmldiff import actions, formatting, utils
+from xmldiff.diff import Differ
+
+from .lcs import myers
+
+DIFF_OPTIONS = {'F': 0.5}
+MAX_DIFF_SECONDS = 10.0
+MAX_DIFF_NODES = 5000
+# 改变树结构的编辑操作, 子树的 diff 中出现时改为比较整棵树
+STRUCTURAL_ACTIONS = (actions.InsertNode, actions.DeleteNode, actions.MoveNode, actions.RenameNode)
+
+
+def tree_digest(path):
+    """path 处 XML 文件的规范化哈希 (十六进制字符串)"""
+    root = etree.parse(path).getroot()
+    return subtree_digests(root)[root].hex()
+
+
+def subtree_digests(root):
+    """root 下每个元素 (包括 root) 的规范化哈希, 返回 {元素: bytes}"""
+    digests = {}
+    # 逆文档序遍历, 子节点总在父节点之前处理, 不需要递归
+    for element in reversed(list(root.iter())):
+        h = sha256(_node_key(element))
+        for child in element:
+            h.update(digests[child])
+        digests[element] = h.digest()
+    return digests
+
+
+def _node_key(element):
+    """元素自身 (不含子节点) 的规范化表示"""
+    parts = []
+    for part in (str(element.tag), _normalized_text(element), _normalized_tail(element)):
+        parts.append(b'\1' if part is None else b'\0' + part.encode('utf-8'))
+    for name, value in sorted(element.attrib.items()):
+        parts.append(name.encode('utf-8') + b'\0' + value.encode('utf-8'))
+    parts.append(str(len(element)).encode('utf-8'))
+    return b'\0'.join(parts)
+
+
+class TreeDiff:
+    """
+    - actions: xmldiff 的编辑操作, 路径相对于整棵学生的树
+    - text: DiffFormatter 格式化的 actions, 没有差异时为空字符串
+    - similarity: 0 到 1, 1 - 编辑操作数 / 两棵树的节点总数
+    - approximate: 超出预算, actions 由哈希匹配得到, 只是差异的概要
+    """
+
+    def __init__(self, actions, text, similarity, approximate=False):
+        self.actions = actions
+        self.text = text
+        self.similarity = similarity
+        self.approximate = approximate
+
+
+class DiffTimeout(Exception):
+    pass
+
+
+class BudgetDiffer(Differ):
+    """超过 deadline (time.monotonic) 时抛出 DiffTimeout 的 Differ"""
+
+    def __init__(self, deadline, **options):
+        super().__init__(**options)
+        self.deadline = deadline
+
+    def _check_(self):
+        if time.monotonic() > self.deadline:
+            raise DiffTimeout()
+
+    def node_ratio(self, left, right):
+        self._check_()
+        return super().node_ratio(left, right)
+
+    def align_children(self, left, right):
+        self._check_()
+        return super().align_children(left, right)
+
+
+def diff_files(stu_path, gold_path, max_seconds=None, max_nodes=None):
+    """比较两个 XML 文件, 只对不同的最小子树运行 xmldiff, 子树中有结构变化且整棵树不超过 max_nodes 时比较整棵树
+
+    :param max_seconds: xmldiff 的时间预算, 默认为 MAX_DIFF_SECONDS
+    :param max_nodes: 交给 xmldiff 的最大节点数 (两棵子树之和), 默认为 MAX_DIFF_NODES
+    """
+    max_seconds = MAX_DIFF_SECONDS if max_seconds is None else max_seconds
+    max_nodes = MAX_DIFF_NODES if max_nodes is None else max_nodes
+    parser = etree.XMLParser(remove_blank_text=True)
+    stu_root = etree.parse(stu_path, parser).getroot()
+    gold_root = etree.parse(gold_path, parser).getroot()
+    stu_digests = subtree_digests(stu_root)
+    gold_digests = subtree_digests(gold_root)
+    node_num = len(stu_digests) + len(gold_digests)
+    if stu_digests[stu_root] == gold_digests[gold_root]:
+        return TreeDiff([], '', 1.0)
+
+    stu, gold = _minimal_difference(stu_root, gold_root, stu_digests, gold_digests)
+    deadline = time.monotonic() + max_seconds
+    approximate = False
+    try:
+        if _size(stu) + _size(gold) > max_nodes:
+            raise DiffTimeout()
+        edits = list(BudgetDiffer(deadline, **DIFF_OPTIONS).diff(deepcopy(stu), deepcopy(gold)))
+        if stu is not stu_root:
+            edits = [_relocate(action, stu) for action in edits]
+            if any(isinstance(action, STRUCTURAL_ACTIONS) for action in edits) and node_num <= max_nodes:
+                # 插入或删除的节点可能与子树之外的节点匹配 (整棵树的 diff 会报告为 move), 改为比较整棵树
+                try:
+                    differ = BudgetDiffer(deadline, **DIFF_OPTIONS)
+                    edits = list(differ.diff(deepcopy(stu_root), deepcopy(gold_root)))
+                except DiffTimeout:
+                    # 超出预算时保留子树的 diff
+                    pass
+    except DiffTimeout:
+        approximate = True
+        edits = _approximate_diff(stu, gold, stu_digests, gold_digests)
+    text = formatting.DiffFormatter().format(edits, stu_root)
+    similarity = max(0.0, 1 - len(edits) / node_num)
+    return TreeDiff(edits, text, similarity, approximate)
+
+
+def _size(element):
+    return sum(1 for _ in element.iter())
+
+
+def _approximate_diff(stu, gold, stu_digests, gold_digests):
+    """
+    自顶向下的哈希匹配, 线性时间. 子节点按 tag 用 LCS 对齐, 哈希相同的子树直接跳过,
+    对齐的子节点继续比较, 没有对齐的子节点记为整棵删除或插入 (不展开其内容).
+    """
+    edits = []
+    stack = [(stu, gold)]
+    while stack:
+        stu, gold = stack.pop()
+        path = utils.getpath(stu)
+        if stu.tag != gold.tag:
+            edits.append(actions.RenameNode(path, gold.tag))
+        if _normalized_text(stu) != _normalized_text(gold):
+            edits.append(actions.UpdateTextIn(path, gold.text, stu.text))
+        if _normalized_tail(stu) != _normalized_tail(gold):
+            edits.append(actions.UpdateTextAfter(path, gold.tail, stu.tail))
+        for name in sorted(set(stu.attrib) | set(gold.attrib)):
+            if name not in gold.attrib:
+                edits.append(actions.DeleteAttrib(path, name))
+            elif name not in stu.attrib:
+                edits.append(actions.InsertAttrib(path, name, gold.attrib[name]))
+            elif stu.attrib[name] != gold.attrib[name]:
+                edits.append(actions.UpdateAttrib(path, name, gold.attrib[name]))
+
+        stu_children, gold_children = list(stu), list(gold)
+        matched = myers(stu_children, gold_children, key=lambda element: element.tag)
+        matched_stu = {i for i, _ in matched}
+        matched_gold = {j for _, j in matched}
+        for i, child in enumerate(stu_children):
+            if i not in matched_stu:
+                edits.append(actions.DeleteNode(utils.getpath(child)))
+        for j, child in enumerate(gold_children):
+            if j not in matched_gold:
+                edits.append(actions.InsertNode(path, child.tag, j))
+        for i, j in reversed(matched):
+            if stu_digests[stu_children[i]] != gold_digests[gold_children[j]]:
+                stack.append((stu_children[i], gold_children[j]))
+    return edits
+
+
+def _normalized_text(element):
+    text = element.text
+    if len(element) and text is not None and not text.strip():
+        return None
+    return text
+
+
+def _normalized_tail(element):
+    tail = element.tail
+    if tail is not None and not tail.strip():
+        return None
+    return tail
+
+
+def _minimal_difference(stu, gold, stu_digests, gold_digests):
+    """
+    从根向下, 当两个元素自身相同且只有一对位置相同的子节点不同时进入该子节点,
+    返回不能再缩小的一对子树
+    """
+    while _node_key(stu) == _node_key(gold):
+        different = [(stu_child, gold_child) for stu_child, gold_child in zip(stu, gold)
+                     if stu_digests[stu_child] != gold_digests[gold_child]]
+        if len(different) != 1:
+            break
+        stu, gold = different[0]
+    return stu, gold
+
+
+def _relocate(action, subtree):
+    """把以 subtree 副本为根的路径改写为整棵树中的路径"""
+    prefix = '/' + subtree.tag
+    # 与 xmldiff 一致: 路径中间的元素只在有同名兄弟时带序号, 最后一个元素总是带序号
+    inner_path = subtree.getroottree().getpath(subtree)
+
+    def relocate(xpath):
+        if xpath == prefix or xpath == prefix + '[1]':
+            return utils.getpath(subtree)
+        if xpath.startswith(prefix + '/'):
+            return inner_path + xpath[len(prefix):]
+        return xpath
+
+    changes = {field: relocate(getattr(action, field)) for field in ('node', 'target') if field in action._fields}
+    return action._replace(**changes)
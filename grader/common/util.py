@@ -1,4 +1,8 @@
+import hashlib
 import json
+import os
+import threading
+from collections import defaultdict, deque
 
 
 def remove_extension(path: str):
@@ -14,3 +18,53 @@ def load_json(path: str):
 def check_extension(file_name, exts):
     if not file_name.endswith(exts):
         raise ValueError('only ' + str(exts) + ' are accepted for grading')
+
+
+def match_records(gold_records, stu_records):
+    """
+    一对一匹配相等的记录 (记录需可哈希), 匹配上的记录 passed 设为 True.
+    每个学生记录最多匹配一个标准记录, 相等的记录按出现顺序匹配.
+
+    :return: 与 gold_records 对应的 [是否匹配]
+    """
+    unmatched = defaultdict(deque)
+    for stu in stu_records:
+        unmatched[stu].append(stu)
+    result = []
+    for gold in gold_records:
+        candidates = unmatched.get(gold)
+        if candidates:
+            stu = candidates.popleft()
+            stu.passed = True
+            gold.passed = True
+            result.append(True)
+        else:
+            result.append(False)
+    return result
+
+
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def file_digest(path: str):
+    """
+    sha256 of file content, memorized by (path, mtime, size) so that a jar is hashed only once
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    with _digests_lock:
+        digest = _digests.get(memo_key)
+    if digest is None:
+        digest = _compute_digest(path)
+        with _digests_lock:
+            _digests[memo_key] = digest
+    return digest
+
+
+def _compute_digest(path: str):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
@@ -1,16 +1,121 @@
+"""
+命令行评测入口
+
+评测单份提交:
+    python -m grader.grade --code public/code/lexer --gold public/golden/lexer solution.jar
+
+批量评测 (目录或清单文件), 每份提交评测完成后立即输出总分, 报告写入其输出目录下的 report.txt:
+    python -m grader.grade --stage all --code public/code --gold public/golden --batch submissions/
+
+以参考解校准超时时间 (写入各阶段 gold 目录下的 timing.json):
+    python -m grader.grade --stage all --code public/code --gold public/golden --calibrate reference.jar
+"""
 import argparse
+import os
+import sys
 
-from lex import LexerGrader
+from .common import golden, tree
+from .common.cache import ResultCache
+from .common.cds import CDSArchive
+from .common.failfast import FailFastPolicy
+from .common.journal import Journal
+from .common.process import DEFAULT_MAX_OUTPUT
+from .common.render import use_bytecode_cache
+from .common.timeout import TimeoutPolicy
+from .pipeline import Pipeline, load_submissions
+from .semantic import type as type_check
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--code", required=True, help="The test code")
 parser.add_argument("--gold", required=True, help="The golden solution of test code")
-parser.add_argument("jar", help="The jar of your solution")
+parser.add_argument("--stage", default='lex', choices=['lex', 'parse', 'semantic', 'ir', 'all'],
+                    help="The stage to grade, --code and --gold are the root of public dir for 'all'")
+parser.add_argument("--workers", type=int, default=None, help="Max number of concurrent jobs, default cpu count")
+parser.add_argument("--cache", default=None, help="Directory of the result cache")
+parser.add_argument("--cds", default=None, help="Directory of the CDS archives, enables CDS for faster JVM startup")
+parser.add_argument("--timeout", action='append', default=[], metavar='STAGE=SECONDS',
+                    help="Fixed timeout of a stage (lex, parse, cs, name, type, interpret), can be repeated")
+parser.add_argument("--budget", type=float, default=None, help="Total time budget of each submission in seconds")
+parser.add_argument("--max-output", type=int, default=DEFAULT_MAX_OUTPUT,
+                    help="Max bytes of stdout and stderr kept for each run, the rest is truncated")
+parser.add_argument("--fail-fast", type=int, default=0, metavar='N',
+                    help="Skip the remaining runs of a submission whose first N runs failed with the same error")
+parser.add_argument("--calibrate", action='store_true',
+                    help="Grade the reference solution and save its run times as timing.json under --gold")
+parser.add_argument("--diff-timeout", type=float, default=tree.MAX_DIFF_SECONDS,
+                    help="Seconds an AST diff may take before falling back to an approximate diff")
+parser.add_argument("--diff-max-nodes", type=int, default=tree.MAX_DIFF_NODES,
+                    help="Max nodes of an AST diff, larger trees get an approximate diff")
+parser.add_argument("--type-diff", action='store_true',
+                    help="Include a full xmldiff of the typed AST in type check reports, slow on large outputs")
+parser.add_argument("--golden-cache", default=None,
+                    help="Directory of the precompiled golden outputs, shared between grading processes")
+parser.add_argument("--template-cache", default=None,
+                    help="Directory of the compiled report templates, shared between grading processes")
+parser.add_argument("--batch", default=None, help="A directory or manifest file of submissions")
+parser.add_argument("--journal", default=None,
+                    help="SQLite journal of finished tests, rerun with the same journal to resume an interrupted run")
+parser.add_argument("jar", nargs='?', help="The jar of your solution")
+
+
+def build_timeouts(args):
+    overrides = {}
+    for item in args.timeout:
+        stage, _, seconds = item.partition('=')
+        overrides[stage] = float(seconds)
+    return TimeoutPolicy(overrides=overrides, budget=args.budget, calibrate=args.calibrate)
+
+
+def build_pipeline(args, cds, timeouts):
+    # 校准时必须真实运行参考解
+    cache = ResultCache(args.cache) if args.cache and not args.calibrate else None
+    journal = Journal(args.journal) if args.journal else None
+    fail_fast = FailFastPolicy(args.fail_fast) if args.fail_fast else None
+    options = dict(cache=cache, cds=cds, timeouts=timeouts, max_output=args.max_output, fail_fast=fail_fast)
+    if args.stage == 'all':
+        return Pipeline.course(args.code, args.gold, args.workers, journal, **options)
+    return Pipeline.stage(args.stage, args.code, args.gold, args.workers, journal, **options)
+
+
+def write_reports(reports, stream):
+    for report in reports:
+        report.write_detail(stream)
+        stream.write('\n')
+
+
+def summary(submission, reports, cds):
+    line = "{0}: {1}/{2}".format(submission, sum(report.grade for report in reports),
+                                 sum(report.total_grade for report in reports))
+    record = cds.record(submission.path) if cds is not None else None
+    if record is not None and 'saving' in record:
+        line += ", CDS startup saving {0:.0f}ms/run".format(record['saving'] * 1000)
+    return line
+
 
 if __name__ == '__main__':
     args = parser.parse_args()
+    if (args.jar is None) == (args.batch is None):
+        parser.error('exactly one of jar and --batch is required')
 
-    grader = LexerGrader(args.code, args.gold)
-    reports = grader.run(args.jar)
-    for report in reports:
-        print(report.render())
+    tree.MAX_DIFF_SECONDS = args.diff_timeout
+    tree.MAX_DIFF_NODES = args.diff_max_nodes
+    type_check.RENDER_DIFF = args.type_diff
+    golden.CACHE_DIR = args.golden_cache
+    if args.template_cache:
+        use_bytecode_cache(args.template_cache)
+    cds = CDSArchive(args.cds) if args.cds else None
+    timeouts = build_timeouts(args)
+    pipeline = build_pipeline(args, cds, timeouts)
+    if args.calibrate:
+        if args.jar is None:
+            parser.error('--calibrate requires the jar of the reference solution')
+        pipeline.grade(args.jar)
+        timeouts.save()
+    elif args.batch is None:
+        write_reports(pipeline.grade(args.jar), sys.stdout)
+    else:
+        for submission, reports in pipeline.grade_many(load_submissions(args.batch)):
+            os.makedirs(submission.out_dir, exist_ok=True)
+            with open(os.path.join(submission.out_dir, 'report.txt'), 'w') as f:
+                write_reports(reports, f)
+            print(summary(submission, reports, cds), flush=True)
@@ -1,12 +1,13 @@
 import datetime
+import functools
 import logging
 import os
-import subprocess
-from pathlib import Path
+import threading
 
-from jinja2 import Template
-
-from ..common import BaseReport, Grader, check_extension, listdirpath
+from ..common import BaseReport, Grader, Task, listdirpath
+from ..common.process import execute, DEFAULT_MAX_OUTPUT
+from ..common.render import render
+from .compare import OutputComparator, first_difference
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("Intermediate Code Grader")
@@ -17,53 +18,146 @@ class IRGrader(Grader):
     run `xx.jar -t interpret -o tmp.out test.c`
     - we don't care about output file actually
     - redirect stdin and stdout
+
+    每个输入文件是一次独立的执行, 同一程序的所有输入执行完毕后汇总为一个 IRReport.
+    输入和标准输出由 load_test_data 读入内存, 所有提交共享, 不再每次读盘
     """
 
-    def grade(self, submitted_file):
-        check_extension(submitted_file, ('.jar', '.zip'))
-        self.submitted_file = submitted_file
+    PASSED = 'passed'
+    WRONG_ANSWER = 'wrong answer'
+    RUNTIME_ERROR = 'runtime error'
+    TIMEOUT = 'timeout'
+
+    def __init__(self, test_code_dir, test_gold_dir, workers=1, cds=None, timeouts=None,
+                 max_output=DEFAULT_MAX_OUTPUT, fail_fast=None):
+        super().__init__(test_code_dir, test_gold_dir, workers, timeouts, fail_fast)
+        self.cds = cds
+        self.max_output = max_output
+
+    def tasks(self, submission):
+        tasks = []
+        for test_case in sorted(listdirpath(self.test_code_dir, 'c')):
+            basename = os.path.basename(test_case)[:-2]
+            data_dir = os.path.join(os.path.dirname(test_case), basename)
+            runs = [functools.partial(self.__run_input__, submission, test_case, data)
+                    for data in load_test_data(data_dir)]
+            tasks.append(Task('interpret', basename, runs, functools.partial(self.__report__, basename)))
+        return tasks
+
+    def __run_input__(self, submission, test_case, data):
+        """
+        :param data: 该输入的 TestData
+        :return: (输入文件名, 结果, 信息, 资源占用)
+        """
+        submitted_file = submission.path
+        input_basename = data.name
+        if self.fail_fast is not None:
+            failure = self.fail_fast.check(submission, 'interpret')
+            if failure is not None:
+                return input_basename, IRGrader.RUNTIME_ERROR, \
+                    input_basename + " fail(runtime error): " + failure[1], None
+        # 参考耗时以 程序名/输入名 为键
+        timing_name = os.path.basename(test_case)[:-2] + '/' + input_basename
+        limit = functools.partial(self.timeouts.limit, submission, 'interpret', self.test_gold_dir, timing_name)
+        app_args = ['--target', 'interpret', test_case]
+        # 生成 CDS 归档的探测同样计入预算, 之后再计算本次运行的超时时间
+        cds_args = self.cds.vm_args(submitted_file, app_args, data.input, limit, submission) \
+            if self.cds is not None else []
+        timeout = limit(reserve=True)
+        if timeout <= 0:
+            return input_basename, IRGrader.TIMEOUT, input_basename + " fail(" + Grader.BUDGET_EXHAUSTED + ")", None
+        cmd = ['java'] + cds_args + ['--enable-preview', '-jar', submitted_file] + app_args
+        # 保留的输出至少要能容纳标准输出, 否则截断会导致误判
+        max_output = max(self.max_output, 2 * data.expected_size)
+        # 边运行边比较, 输出一旦确定错误或超过保留的上限就杀死子进程, 不必等到超时
+        comparator = OutputComparator(data.expected, max_output)
+        execution = execute(cmd, data.input_bytes, timeout=timeout, max_output=max_output,
+                            on_stdout=comparator.write)
+        self.timeouts.charge(submission, self.test_gold_dir, timing_name, execution.usage)
+        if execution.timed_out:
+            return input_basename, IRGrader.TIMEOUT, input_basename + " fail(timeout)", execution.usage
+
+        stdout = normalize_newlines(execution.stdout.decode('utf-8', errors='replace'))
+        stderr = normalize_newlines(execution.stderr.decode('utf-8', errors='replace'))
+        if self.fail_fast is not None:
+            self.fail_fast.observe(submission, 'interpret', test_case, execution.return_code, stderr)
+        if stderr != '':
+            verdict, msg = IRGrader.RUNTIME_ERROR, input_basename + " fail(runtime error): " + stderr
+        elif execution.stopped or stdout.strip() != data.expected:
+            verdict, msg = IRGrader.WRONG_ANSWER, input_basename + " fail(wrong answer): " + \
+                _describe_difference_(comparator, stdout.strip(), data.expected)
+        else:
+            verdict, msg = IRGrader.PASSED, input_basename + " passed"
+        return input_basename, verdict, msg, execution.usage
+
+    @staticmethod
+    def __report__(basename, results):
+        report = IRReport(basename)
+        for _, verdict, msg, usage in results:
+            report.msgs.append(msg)
+            if usage is not None:
+                report.usage = usage + report.usage
+            report.num_test_cases += 1
+            if verdict == IRGrader.PASSED:
+                report.num_passed += 1
+            elif verdict == IRGrader.WRONG_ANSWER:
+                report.wa_num += 1
+            elif verdict == IRGrader.TIMEOUT:
+                report.timeout_num += 1
+            else:
+                report.re_num += 1
+        return report
 
-        reports = []
-        for test_case in listdirpath(self.test_code_dir, 'c'):
-            reports.append(self.__grade_single__(test_case))
 
-        return reports
+def _describe_difference_(comparator, actual, expected):
+    if comparator.exceeded:
+        return "output exceeds {0} bytes".format(comparator.limit)
+    if comparator.difference is not None:
+        offset = comparator.difference
+    else:
+        offset = first_difference(expected, actual)
+    return "first difference at line {0} (byte {1})".format(comparator.line(offset), offset)
 
-    def __grade_single__(self, test_case):
-        basename = os.path.basename(test_case)[:-2]
-        dirname = os.path.dirname(test_case)
 
-        data_dir = os.path.join(dirname, basename)
-        input_dir = os.path.join(data_dir, 'input')
-        output_dir = os.path.join(data_dir, 'output')
+class TestData:
+    """一个输入文件及其标准输出, 在所有提交间共享, 不能修改"""
 
-        report = IRReport(basename)
-        for input_path in listdirpath(input_dir, 'in'):
-            input_basename = os.path.basename(input_path)[:-3]
-            output_path = os.path.join(output_dir, input_basename + '.out')
-
-            input_data = read_file_content(input_path)
-            output_data = read_file_content(output_path)
-
-            cmd = ['java', '--enable-preview', '-jar', self.submitted_file, '--target', 'interpret', test_case]
-            p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE, text=True)
-            try:
-                stdout, stderr = p.communicate(input=input_data, timeout=10)
-                if stderr != '':
-                    report.msgs.append(input_basename + " fail(runtime error): " + stderr)
-                elif stdout.strip() != output_data.strip():
-                    report.msgs.append(input_basename + " fail(wrong answer)")
-                else:
-                    report.msgs.append(input_basename + " passed")
-                    report.num_passed += 1
-            except subprocess.TimeoutExpired:
-                p.kill()
-                report.msgs.append(input_basename + " fail(timeout)")
+    __slots__ = ('name', 'input', 'input_bytes', 'expected', 'expected_size')
 
-            report.num_test_cases += 1
+    def __init__(self, name, input_data, output_data):
+        self.name = name
+        self.input = input_data
+        self.input_bytes = input_data.encode('utf-8')
+        # 比较时忽略首尾空白
+        self.expected = output_data.strip()
+        self.expected_size = len(output_data.encode('utf-8'))
 
-        return report
+
+_test_data = {}
+_test_data_lock = threading.Lock()
+
+
+def load_test_data(data_dir):
+    """
+    返回 data_dir/input/*.in 及对应的 data_dir/output/*.out, 按输入文件名排序的 TestData 元组.
+    结果按 (目录, 各文件的 mtime 和大小) 缓存在进程内, 文件变化后重新读取.
+    """
+    inputs = sorted(listdirpath(os.path.join(data_dir, 'input'), 'in'))
+    outputs = [os.path.join(data_dir, 'output', os.path.basename(path)[:-3] + '.out') for path in inputs]
+    signature = tuple((path, stat.st_mtime_ns, stat.st_size)
+                      for path, stat in ((path, os.stat(path)) for path in inputs + outputs))
+    memo_key = os.path.abspath(data_dir)
+    with _test_data_lock:
+        entry = _test_data.get(memo_key)
+    if entry is not None and entry[0] == signature:
+        return entry[1]
+
+    data = tuple(TestData(os.path.basename(input_path)[:-3], read_file_content(input_path),
+                          read_file_content(output_path))
+                 for input_path, output_path in zip(inputs, outputs))
+    with _test_data_lock:
+        _test_data[memo_key] = (signature, data)
+    return data
 
 
 def read_file_content(path):
@@ -71,6 +165,11 @@ def read_file_content(path):
         return f.read()
 
 
+def normalize_newlines(text):
+    """与文本模式读取一致, 把 \\r\\n 和 \\r 转换为 \\n"""
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
 class IRReport(BaseReport):
 
     def __init__(self, report_name):
@@ -97,16 +196,15 @@ class IRReport(BaseReport):
 
     @property
     def detail(self):
-        with open(os.path.join(Path(__file__).parent.absolute(), 'report.html'), 'r') as f:
-            template = Template(f.read(), lstrip_blocks=True, trim_blocks=True)
-            return template.render(date=self.creation_date,
-                                   file_name=self._report_name,
-                                   correct_num=self.num_passed,
-                                   total=self.num_test_cases,
-                                   wa_num=self.wa_num,
-                                   timeout_num=self.timeout_num,
-                                   re_num=self.re_num,
-                                   msgs=self.msgs)
+        return render('ir/report.html',
+                      date=self.creation_date,
+                      file_name=self._report_name,
+                      correct_num=self.num_passed,
+                      total=self.num_test_cases,
+                      wa_num=self.wa_num,
+                      timeout_num=self.timeout_num,
+                      re_num=self.re_num,
+                      msgs=self.msgs)
 
     def __str__(self):
         return "{0}[{1}/{2}]: {3}".format(self.report_name, self.grade, self.total_grade, self.detail)
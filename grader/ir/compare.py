@@ -0,0 +1,95 @@
+"""
+边运行边比较解释器输出
+
+OutputComparator 在读取 stdout 的线程中逐块检查输出, 与最终的 stdout.strip() == expected 比较一致:
+换行统一为 \\n, 忽略首尾空白. 一旦确定不一致 (出现不同的字节, 或输出超过上限) 就返回 False,
+调用方随即杀死子进程, 不必等到超时.
+
+只在能逐字节确定时才判定不一致. 首尾出现非 ASCII 字节时无法判断是否为 Unicode 空白,
+此时不再检查, 交给子进程结束后的完整比较.
+"""
+
+# str.strip() 会去掉的 ASCII 空白
+WHITESPACE = b' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f'
+# 按 utf-8 解码时无效字节被替换为的字符, 标准输出中含有它时无法逐字节比较
+REPLACEMENT = '\ufffd'.encode('utf-8')
+
+
+class OutputComparator:
+
+    def __init__(self, expected, limit):
+        """
+        :param expected: 标准输出 (已去掉首尾空白的文本)
+        :param limit: 输出的字节数上限, 超过即判定为不一致
+        """
+        self.expected = expected.encode('utf-8')
+        self.limit = limit
+        self.total = 0
+        # 已匹配的标准输出前缀长度
+        self.matched = 0
+        # 是否已经跳过开头的空白
+        self.started = False
+        self.pending_cr = False
+        self.undecided = REPLACEMENT in self.expected
+        # 第一个不同之处在标准输出中的字节偏移
+        self.difference = None
+        self.exceeded = False
+
+    def write(self, chunk):
+        """检查新读到的一块输出, 返回 False 表示已确定不一致"""
+        if self.difference is not None:
+            return False
+        self.total += len(chunk)
+        if self.total > self.limit:
+            self.exceeded = True
+            self.difference = self.matched
+            return False
+        if self.undecided:
+            return True
+
+        chunk = self._normalize_(chunk)
+        if not self.started:
+            chunk = chunk.lstrip(WHITESPACE)
+            if not chunk:
+                return True
+            self.started = True
+
+        n = min(len(chunk), len(self.expected) - self.matched)
+        if chunk[:n] != self.expected[self.matched:self.matched + n]:
+            i = next(i for i in range(n) if chunk[i] != self.expected[self.matched + i])
+            self._diverge_(self.matched + i, chunk[i], self.matched + i == 0)
+            return self.difference is None
+        self.matched += n
+
+        # 标准输出已全部匹配, 之后只能是空白
+        rest = chunk[n:].lstrip(WHITESPACE)
+        if rest:
+            self._diverge_(self.matched, rest[0], True)
+        return self.difference is None
+
+    def _diverge_(self, offset, byte, at_end):
+        # 首尾的非 ASCII 字节可能是 Unicode 空白
+        if at_end and byte >= 0x80:
+            self.undecided = True
+        else:
+            self.difference = offset
+
+    def _normalize_(self, chunk):
+        """与 normalize_newlines 一致, \\r\\n 可能跨越两块"""
+        if self.pending_cr and chunk[:1] == b'\n':
+            chunk = chunk[1:]
+        self.pending_cr = chunk.endswith(b'\r')
+        if b'\r' in chunk:
+            chunk = chunk.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+        return chunk
+
+    def line(self, offset):
+        """标准输出中 offset 所在的行号 (从 1 开始)"""
+        return self.expected.count(b'\n', 0, offset) + 1
+
+
+def first_difference(expected, actual):
+    """两段文本第一个不同之处在 expected 中的字节偏移, 以 utf-8 计"""
+    expected, actual = expected.encode('utf-8'), actual.encode('utf-8')
+    n = min(len(expected), len(actual))
+    return next((i for i in range(n) if expected[i] != actual[i]), n)
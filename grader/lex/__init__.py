@@ -6,12 +6,15 @@
 """
 import logging
 import os
-
-import untangle
+from concurrent.futures import ProcessPoolExecutor
+from itertools import compress, repeat
+from operator import attrgetter, ne
 
 from .report import AnalysisUnit, LexerReport, Message
-from ..common import Runner, BaseGrader
-from ..common.lcs import lcs as compute_lcs
+from .token import prepare_gold, read_tokens
+from ..common import Runner, BaseGrader, ErrorReport
+from ..common.golden import compile_golden
+from ..common.lcs import intern_with, myers_ids
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("Lexer Grader")
@@ -29,21 +32,41 @@ class LexerGrader(BaseGrader):
         :param gold_xml: 标准输出xml文件的内容
         :return:
         """
-        stu_tokens = untangle.parse(stu_xml).tokens.token
-        gold_tokens = untangle.parse(gold_xml).tokens.token
-        rough_result = LexerGrader._rough_cmp(stu_tokens, gold_tokens)
-        for unit in rough_result:
-            if unit.status == AnalysisUnit.SIMILAR:
-                LexerGrader._analyze_similar(unit)
-        report = LexerReport(os.path.basename(gold_xml),
+        return LexerGrader._grade_(stu_xml, compile_golden(gold_xml, prepare_gold), os.path.basename(gold_xml))
+
+    def grade_batch(self, stu_xmls, gold_xml, workers=None):
+        """ 把许多学生的输出与同一个标准输出比较
+
+        标准输出只预处理一次; workers 不为1时在多个进程中评测, 每个进程启动时接收一份预处理结果.
+
+        :param stu_xmls: 学生输出xml文件的路径
+        :param gold_xml: 标准输出xml文件的路径
+        :param workers: 进程数, 默认为cpu数
+        :return: 与 stu_xmls 顺序对应的报告, 无法评测的输出对应 ErrorReport
+        """
+        gold = compile_golden(gold_xml, prepare_gold)
+        report_name = os.path.basename(gold_xml)
+        if workers == 1:
+            return [_grade_with_gold_(stu_xml, gold, report_name) for stu_xml in stu_xmls]
+        with ProcessPoolExecutor(workers, initializer=_init_worker_, initargs=(gold,)) as pool:
+            return list(pool.map(_grade_in_worker_, stu_xmls, repeat(report_name), chunksize=8))
+
+    @staticmethod
+    def _grade_(stu_xml, gold, report_name):
+        stu_tokens = read_tokens(stu_xml)
+        rough_result = LexerGrader._rough_cmp(stu_tokens, gold)
+        LexerGrader._analyze_similar([unit for unit in rough_result if unit.status == AnalysisUnit.SIMILAR])
+        report = LexerReport(report_name,
                              stu_tokens,
-                             gold_tokens,
+                             gold.tokens,
                              rough_result)
         return report
 
     @staticmethod
-    def _rough_cmp(stu_tokens, gold_tokens):
-        lcs = compute_lcs(stu_tokens, gold_tokens, lambda x, y: x.type == y.type)
+    def _rough_cmp(stu_tokens, gold):
+        gold_tokens = gold.tokens
+        stu_type_ids = intern_with(gold.ids, stu_tokens, key=lambda token: token.type)
+        lcs = myers_ids(stu_type_ids, gold.type_ids)
         stu_idxes, gold_idxes = [], []
         for stu_idx, gold_idx in lcs:
             stu_idxes.append(stu_idx)
@@ -75,36 +98,55 @@ class LexerGrader(BaseGrader):
 
         return result
 
+    # 按顺序比较的字段, 以及不相等时的消息类型
+    SIMILAR_FIELDS = (('source', Message.warning),
+                      ('value', Message.error),
+                      ('line', Message.error),
+                      ('column', Message.error),
+                      ('start', Message.error),
+                      ('stop', Message.error))
+
     @staticmethod
-    def _analyze_similar(analysis_unit):
+    def _analyze_similar(analysis_units):
         """
         Similar unit has the same type, so we only need to compare
         source, value, line, column, start, stop
+
+        一次比较所有 unit 的全部字段得到差异掩码, 只为存在差异的 unit 逐字段生成消息
         """
-        stu_token = analysis_unit.stu_token
-        gold_token = analysis_unit.gold_token
-
-        msgs = []
-        warning_num = 0
-        error_num = 0
-
-        def cmp_property(stu, gold, name, msg_factory):
-            if stu != gold:
-                msgs.append(msg_factory("expect {0}={1}, got {0}={2}".format(name, gold.cdata, stu.cdata)))
-                return 1
-            return 0
-
-        warning_num += cmp_property(stu_token.source, gold_token.source, 'source', Message.warning)
-        error_num += cmp_property(stu_token.value, gold_token.value, 'value', Message.error)
-        error_num += cmp_property(stu_token.line, gold_token.line, 'line', Message.error)
-        error_num += cmp_property(stu_token.column, gold_token.column, 'column', Message.error)
-        error_num += cmp_property(stu_token.start, gold_token.start, 'start', Message.error)
-        error_num += cmp_property(stu_token.stop, gold_token.stop, 'stop', Message.error)
-
-        analysis_unit.msgs.extend(msgs)
-        if error_num > 0:
-            analysis_unit.status = AnalysisUnit.ERROR
-        elif warning_num > 0:
-            analysis_unit.status = AnalysisUnit.WARNING
-        else:
-            analysis_unit.status = AnalysisUnit.CORRECT
+        fields = attrgetter(*(name for name, _ in LexerGrader.SIMILAR_FIELDS))
+        differs = list(map(ne,
+                           map(fields, [unit.stu_token for unit in analysis_units]),
+                           map(fields, [unit.gold_token for unit in analysis_units])))
+
+        for unit in analysis_units:
+            unit.status = AnalysisUnit.CORRECT
+        for unit in compress(analysis_units, differs):
+            for name, msg_factory in LexerGrader.SIMILAR_FIELDS:
+                gold, stu = getattr(unit.gold_token, name), getattr(unit.stu_token, name)
+                if stu != gold:
+                    unit.msgs.append(msg_factory("expect {0}={1}, got {0}={2}".format(name, gold, stu)))
+                    if msg_factory is Message.error:
+                        unit.status = AnalysisUnit.ERROR
+                    elif unit.status != AnalysisUnit.ERROR:
+                        unit.status = AnalysisUnit.WARNING
+
+
+def _grade_with_gold_(stu_xml, gold, report_name):
+    try:
+        return LexerGrader._grade_(stu_xml, gold, report_name)
+    except Exception as e:
+        return ErrorReport(report_name, LexerReport.TOTAL_GRADE, stu_xml + "\n\n" + str(e))
+
+
+# 工作进程中预处理过的标准输出, 由 _init_worker_ 设置
+_worker_gold = None
+
+
+def _init_worker_(gold):
+    global _worker_gold
+    _worker_gold = gold
+
+
+def _grade_in_worker_(stu_xml, report_name):
+    return _grade_with_gold_(stu_xml, _worker_gold, report_name)
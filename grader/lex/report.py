@@ -1,9 +1,7 @@
 import datetime
-import os
 
-from jinja2 import Template
-from pathlib import Path
 from ..common.report import BaseReport
+from ..common.render import render, stream
 
 
 class AnalysisUnit:
@@ -68,6 +66,7 @@ class LexerReport(BaseReport):
         self.error_num = 0
         self.redundant_num = 0
         self.missing_num = 0
+        self._detail = None
 
         for unit in analysis_result:
             if unit.status == AnalysisUnit.CORRECT: self.correct_num += 1
@@ -75,21 +74,34 @@ class LexerReport(BaseReport):
             if unit.status == AnalysisUnit.REDUNDANT: self.redundant_num += 1
             if unit.status == AnalysisUnit.MISSING: self.missing_num += 1
 
+    # 连续超过这么多个 correct 时合并为一行
+    COLLAPSE_CORRECT = 10
+
+    def _context_(self):
+        return dict(date=self.creation_date,
+                    file_name=self.file_name,
+                    stu_total=len(self.stu_tokens),
+                    gold_total=len(self.gold_tokens),
+                    correct_num=self.correct_num,
+                    error_num=self.error_num,
+                    redundant_num=self.redundant_num,
+                    missing_num=self.missing_num,
+                    rows=collapse_correct(self.analysis_result, LexerReport.COLLAPSE_CORRECT))
+
     def render(self):
-        with open(os.path.join(Path(__file__).parent.absolute(), 'report.html'), 'r') as f:
-            template = Template(f.read(), lstrip_blocks=True, trim_blocks=True)
-            return template.render(date=self.creation_date,
-                                   file_name=self.file_name,
-                                   stu_total=len(self.stu_tokens),
-                                   gold_total=len(self.gold_tokens),
-                                   correct_num=self.correct_num,
-                                   error_num=self.error_num,
-                                   redundant_num=self.redundant_num,
-                                   missing_num=self.missing_num,
-                                   units=self.analysis_result)
+        return render('lex/report.html', **self._context_())
+
+    def write_detail(self, out):
+        if self._detail is not None:
+            out.write(self._detail)
+        else:
+            stream(out, 'lex/report.html', **self._context_())
 
     @property
     def grade(self):
+        # 学生输出中没有 token (如空的 <tokens></tokens>)
+        if not self.stu_tokens:
+            return 0
         return int(self.total_grade * (self.correct_num / len(self.stu_tokens)))
 
     @property
@@ -102,4 +114,32 @@ class LexerReport(BaseReport):
 
     @property
     def detail(self):
-        return self.render()
+        if self._detail is None:
+            self._detail = self.render()
+        return self._detail
+
+
+def collapse_correct(units, threshold):
+    """
+    按顺序生成 (序号, unit, 个数), 序号从1开始. 连续超过 threshold 个 correct 合并为一项,
+    此时 unit 为其中第一个, 个数为连续的数量; 其余项个数为1
+    """
+    start, count = 0, 0
+    for index, unit in enumerate(units):
+        if unit.status == AnalysisUnit.CORRECT:
+            if count == 0:
+                start = index
+            count += 1
+            continue
+        yield from _correct_run(units, start, count, threshold)
+        count = 0
+        yield index + 1, unit, 1
+    yield from _correct_run(units, start, count, threshold)
+
+
+def _correct_run(units, start, count, threshold):
+    if count > threshold:
+        yield start + 1, units[start], count
+    else:
+        for index in range(start, start + count):
+            yield index + 1, units[index], 1
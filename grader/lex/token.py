@@ -0,0 +1,54 @@
+"""
+词法单元的紧凑表示
+
+token文件可能很大, untangle 会为每个字段建立一个 Element 对象. 这里用 iterparse 流式读取,
+每读完一个 <token> 就转换为 Token 并清除已解析的元素, 内存只与 token 数量成正比.
+"""
+import sys
+
+from ..common.stream import iter_elements
+
+
+class Token:
+    FIELDS = ('index', 'text', 'type', 'source', 'lexer', 'value', 'line', 'column', 'start', 'stop')
+    __slots__ = FIELDS
+
+    def __init__(self, **fields):
+        for name in Token.FIELDS:
+            setattr(self, name, fields.get(name, ''))
+
+    def __repr__(self):
+        return 'Token({0}, {1!r})'.format(self.type, self.text)
+
+
+class GoldTokens:
+    """
+    预处理过的标准 token 流, 与许多学生的 token 流比较时只需准备一次
+
+    - tokens: Token 列表
+    - ids: type -> 编号
+    - type_ids: 每个 token 的 type 编号
+    """
+    __slots__ = ('tokens', 'ids', 'type_ids')
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.ids = {}
+        self.type_ids = [self.ids.setdefault(token.type, len(self.ids)) for token in tokens]
+
+
+def prepare_gold(source):
+    return GoldTokens(read_tokens(source))
+
+
+def read_tokens(source):
+    """从文件名或文件对象流式读取 <tokens> 下的全部 token
+
+    缺失的字段为空字符串, type 经过 sys.intern, 同类 token 共享同一个字符串
+    """
+    tokens = []
+    for element in iter_elements(source, ('token',)):
+        fields = {child.tag: child.text or '' for child in element}
+        fields['type'] = sys.intern(fields.get('type', ''))
+        tokens.append(Token(**fields))
+    return tokens
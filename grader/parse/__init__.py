@@ -7,12 +7,11 @@
 import datetime
 import logging
 import os
-from pathlib import Path
-
-from jinja2 import Template
 
 from ..common import Runner, BaseGrader, BaseReport
-from xmldiff import main, formatting
+from ..common.golden import compile_golden
+from ..common.render import render
+from ..common.tree import diff_files, tree_digest
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("Parser Grader")
@@ -24,27 +23,23 @@ class ParserGrader(BaseGrader):
         return Runner(target='parse', output_dir='parse_out', output_extension='xml', logger=logger)
 
     def grade_single(self, stu_out, gold_out) -> BaseReport:
-        formatter = formatting.DiffFormatter()
-        diff_text = main.diff_files(stu_out, gold_out, formatter=formatter, diff_options={'F': 0.5})
-
-        # Compute similarity
-
-        # InsertNode, DeleteNode, MoveNode,
-        # InsertAttrib, DeleteAttrib, RenameAttrib, UpdateAttrib,
-        # UpdateTextIn, UpdateTextAfter
-
-        diff = main.diff_files(stu_out, gold_out, diff_options={'F': 0.5})
+        # 规范化哈希相同时不会有差异, 无需 diff
+        if tree_digest(stu_out) == compile_golden(gold_out, tree_digest):
+            return ParserReport(os.path.basename(stu_out), '', 1)
 
-        return ParserReport(os.path.basename(stu_out), diff_text, 0)
+        diff = diff_files(stu_out, gold_out)
+        return ParserReport(os.path.basename(stu_out), diff.text, diff.similarity, diff.approximate)
 
 
 class ParserReport(BaseReport):
 
-    def __init__(self, report_name, diff, similarity):
+    def __init__(self, report_name, diff, similarity, approximate=False):
         self._report_name = report_name
         self.diff = diff
         self.creation_date = datetime.datetime.now()
         self.similarity = similarity
+        # diff 超出预算, 是哈希匹配得到的概要
+        self.approximate = approximate
 
     @property
     def report_name(self):
@@ -60,8 +55,9 @@ class ParserReport(BaseReport):
 
     @property
     def detail(self):
-        with open(os.path.join(Path(__file__).parent.absolute(), 'parse_report.html'), 'r') as f:
-            template = Template(f.read(), lstrip_blocks=True, trim_blocks=True)
-            return template.render(date=self.creation_date,
-                                   status="passed" if self.grade == 100 else "not passed",
-                                   detail=self.diff if self.diff != '' else "null")
+        return render('parse/parse_report.html',
+                      date=self.creation_date,
+                      status="passed" if self.grade == 100 else "not passed",
+                      similarity=self.similarity,
+                      approximate=self.approximate,
+                      detail=self.diff if self.diff != '' else "null")
@@ -0,0 +1,146 @@
+# coding=utf-8
+"""
+    全课程评测流水线
+
+    把各阶段评测器 (词法, 语法, 语义, 中间代码) 的全部任务交给同一个调度器,
+    在全局并发上限下同时执行, 而不是一个阶段接一个阶段地串行评测.
+"""
+import logging
+import os
+from concurrent.futures import Future, as_completed
+
+from .common import Scheduler, Submission, ErrorReport, BaseReport, check_extension, gather
+from .ir import IRGrader
+from .lex import LexerGrader
+from .parse import ParserGrader
+from .semantic import SemanticGrader
+
+logger = logging.getLogger("Pipeline")
+
+
+class Pipeline:
+
+    def __init__(self, graders, workers=None, journal=None):
+        """
+        :param graders: 评测器列表, 报告按评测器顺序排列
+        :param workers: 全局并发上限, 默认为CPU核数
+        :param journal: 评测日志 (Journal), 已记录的评测单元不再执行, 新完成的单元写入日志
+        """
+        self.graders = graders
+        self.workers = workers or os.cpu_count()
+        self.journal = journal
+
+    @staticmethod
+    def course(code_dir, gold_dir, workers=None, journal=None, **options):
+        """
+        按 public 目录结构 (code/lexer, golden/lexer, ...) 构建包含全部阶段的流水线
+
+        :param options: 传给各评测器的参数, 如 cache, cds, timeouts, max_output, fail_fast
+        """
+        graders = [Pipeline._grader_(stage, os.path.join(code_dir, name), os.path.join(gold_dir, name), options)
+                   for stage, name in (('lex', 'lexer'), ('parse', 'parse'), ('semantic', 'semantic'), ('ir', 'ir'))]
+        return Pipeline(graders, workers, journal)
+
+    @staticmethod
+    def stage(stage, code_dir, gold_dir, workers=None, journal=None, **options):
+        """
+        只包含一个阶段 (lex, parse, semantic, ir) 的流水线, code_dir 和 gold_dir 为该阶段的目录
+        """
+        return Pipeline([Pipeline._grader_(stage, code_dir, gold_dir, options)], workers, journal)
+
+    @staticmethod
+    def _grader_(stage, code_dir, gold_dir, options):
+        if stage == 'lex':
+            return LexerGrader(code_dir, gold_dir, **options)
+        elif stage == 'parse':
+            return ParserGrader(code_dir, gold_dir, **options)
+        elif stage == 'semantic':
+            return SemanticGrader(code_dir, gold_dir, **options)
+        elif stage == 'ir':
+            # 中间代码评测不产生输出文件, 没有结果缓存
+            options = {key: value for key, value in options.items() if key != 'cache'}
+            return IRGrader(code_dir, gold_dir, **options)
+        raise ValueError('unknown stage ' + stage)
+
+    def tasks(self, submission):
+        tasks = []
+        for grader in self.graders:
+            tasks += grader.tasks(submission)
+        return tasks
+
+    def grade(self, submitted_file, out_dir=None):
+        check_extension(submitted_file, ('.jar', '.zip'))
+
+        with Scheduler(self.workers) as scheduler:
+            submission = Submission(submitted_file, out_dir)
+            futures = [self._submit_(scheduler, submission, task) for task in self.tasks(submission)]
+            return [future.result() for future in futures]
+
+    def _submit_(self, scheduler, submission, task):
+        if self.journal is None:
+            return scheduler.submit(task)
+
+        report = self.journal.get(submission.key, task.stage, task.name)
+        if report is not None:
+            future = Future()
+            future.set_result(report)
+            return future
+
+        def record(future):
+            if not future.cancelled() and future.exception() is None:
+                self.journal.record(submission.key, task.stage, task.name, future.result())
+
+        future = scheduler.submit(task)
+        future.add_done_callback(record)
+        return future
+
+    def grade_many(self, submissions):
+        """
+        批量评测, 所有提交的所有任务共享同一个线程池, 空闲的线程总是领取下一个待执行的任务
+
+        :param submissions: Submission 列表
+        :return: 生成器, 每当一份提交评测完成即产生 (submission, reports), 顺序为完成顺序
+        """
+        with Scheduler(self.workers) as scheduler:
+            pending = {}
+            for submission in submissions:
+                try:
+                    check_extension(submission.path, ('.jar', '.zip'))
+                    tasks = self.tasks(submission)
+                except Exception as e:
+                    logger.error('can not grade %s: %s', submission, e)
+                    yield submission, [ErrorReport(str(submission), BaseReport.TOTAL_GRADE, str(e))]
+                    continue
+                pending[gather(self._submit_(scheduler, submission, task) for task in tasks)] = submission
+
+            for done in as_completed(pending):
+                submission = pending.pop(done)
+                try:
+                    reports = done.result()
+                except Exception as e:
+                    logger.error('can not grade %s: %s', submission, e)
+                    reports = [ErrorReport(str(submission), BaseReport.TOTAL_GRADE, str(e))]
+                yield submission, reports
+
+
+def load_submissions(path):
+    """
+    读取一批提交
+
+    :param path: 目录 (递归查找其中的 .jar 和 .zip) 或清单文件 (每行一个路径, 相对路径以清单所在目录为基准, # 开头为注释)
+    :return: Submission 列表, 每份提交的输出目录为 jar 所在目录下与 jar 同名的目录
+    """
+    if os.path.isdir(path):
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith(('.jar', '.zip')) and not filename.startswith('.'):
+                    paths.append(os.path.join(dirpath, filename))
+    else:
+        base_dir = os.path.dirname(path)
+        with open(path, 'r') as f:
+            paths = [os.path.join(base_dir, line.strip()) for line in f
+                     if line.strip() and not line.strip().startswith('#')]
+
+    return [Submission(p, os.path.join(os.path.dirname(p), os.path.basename(p)[:-4])) for p in paths]
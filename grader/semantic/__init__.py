@@ -8,6 +8,7 @@ import os
 
 from .type import TypeCheckGrader
 from ..common import Grader
+from ..common.process import DEFAULT_MAX_OUTPUT
 from .cs import ControlStructureGrader
 from .name import NameResolveGrader
 
@@ -17,15 +18,19 @@ logger = logging.getLogger("Semantic Grader")
 
 class SemanticGrader(Grader):
 
-    def __init__(self, test_code_dir, test_gold_dir):
-        super().__init__(test_code_dir, test_gold_dir)
-        self.cs_grader = ControlStructureGrader(os.path.join(test_code_dir, 'cs'), os.path.join(test_gold_dir, 'cs'))
-        self.name_grader = NameResolveGrader(os.path.join(test_code_dir, 'name'), os.path.join(test_gold_dir, 'name'))
-        self.type_grader = TypeCheckGrader(os.path.join(test_code_dir, 'type'), os.path.join(test_gold_dir, 'type'))
+    def __init__(self, test_code_dir, test_gold_dir, workers=1, cache=None, cds=None, timeouts=None,
+                 max_output=DEFAULT_MAX_OUTPUT, fail_fast=None):
+        super().__init__(test_code_dir, test_gold_dir, workers, timeouts, fail_fast)
+        self.cs_grader = ControlStructureGrader(os.path.join(test_code_dir, 'cs'), os.path.join(test_gold_dir, 'cs'),
+                                                workers, cache, cds, timeouts, max_output, fail_fast)
+        self.name_grader = NameResolveGrader(os.path.join(test_code_dir, 'name'), os.path.join(test_gold_dir, 'name'),
+                                             workers, cache, cds, timeouts, max_output, fail_fast)
+        self.type_grader = TypeCheckGrader(os.path.join(test_code_dir, 'type'), os.path.join(test_gold_dir, 'type'),
+                                           workers, cache, cds, timeouts, max_output, fail_fast)
 
-    def grade(self, submitted_file):
-        reports = []
-        reports += self.cs_grader.grade(submitted_file)
-        reports += self.name_grader.grade(submitted_file)
-        reports += self.type_grader.grade(submitted_file)
-        return reports
+    def tasks(self, submission):
+        tasks = []
+        tasks += self.cs_grader.tasks(submission)
+        tasks += self.name_grader.tasks(submission)
+        tasks += self.type_grader.tasks(submission)
+        return tasks
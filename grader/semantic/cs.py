@@ -1,11 +1,13 @@
+import copy
 import datetime
 import logging
 import os
-from pathlib import Path
-import xml.etree.ElementTree as ET
-from jinja2 import Template
 
 from ..common import BaseReport, BaseGrader, Runner
+from ..common.golden import compile_golden
+from ..common.render import render
+from ..common.stream import iter_elements
+from ..common.util import match_records
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("ControlStructure Grader")
@@ -17,50 +19,42 @@ class ControlStructureGrader(BaseGrader):
 
     def grade_single(self, stu_out, gold_out) -> BaseReport:
         stu_css = self._parse_(stu_out)
-        gold_css = self._parse_(gold_out)
-
-        result = []
-        for gold_cs in gold_css:
-            passed = False
-            for stu_cs in stu_css:
-                if stu_cs == gold_cs:
-                    passed = True
-                    stu_cs.passed = True
-                    gold_cs.passed = True
-            result.append(passed)
+        # 缓存的记录被所有提交共享, 复制后再标记 passed
+        gold_css = [copy.copy(cs) for cs in compile_golden(gold_out, self._parse_)]
 
+        result = match_records(gold_css, stu_css)
         return CSReport(os.path.basename(gold_out), result, gold_css, stu_css)
 
     @staticmethod
     def _parse_(out_path):
         css = []
-        cs = ET.parse(out_path).getroot()
-        for item in cs.iter("break"):
-            css.append(ControlStructure(item.findtext('line'),
-                                        'break',
-                                        item.findtext('attachedLoop')))
-        for item in cs.iter("continue"):
-            css.append(ControlStructure(item.findtext('line'),
-                                        'continue',
-                                        item.findtext('attachedLoop')))
-        for item in cs.iter("return"):
-            css.append(ControlStructure(item.findtext('line'),
-                                        'continue',
-                                        item.findtext('attachedFunction')))
+        for item in iter_elements(out_path, ("break", "continue", "return")):
+            # break/continue 附属于循环, return 附属于函数
+            attached = item.findtext('attachedFunction' if item.tag == 'return' else 'attachedLoop')
+            css.append(ControlStructure(item.findtext('line'), item.tag, attached))
         return css
 
 
 class ControlStructure:
+    __slots__ = ('line', 'type', 'def_line', 'passed')
+
     def __init__(self, line, type, def_line):
         self.line = line
         self.type = type
         self.def_line = def_line
         self.passed = False
 
+    @property
+    def key(self):
+        return self.line, self.type, self.def_line
+
     def __eq__(self, other):
         if type(other) != ControlStructure:
             return False
-        return self.line == other.line and self.type == other.type and self.def_line == other.def_line
+        return self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
 
     def __str__(self):
         return "ControlStructure(line={0}, type={1}, def_line={2})".format(self.line, self.type, self.def_line)
@@ -100,12 +94,11 @@ class CSReport(BaseReport):
         return self.render()
 
     def render(self):
-        with open(os.path.join(Path(__file__).parent.absolute(), 'cs_report.html'), 'r') as f:
-            template = Template(f.read(), lstrip_blocks=True, trim_blocks=True)
-            return template.render(date=self.creation_date,
-                                   grade=self.grade,
-                                   total_grade=self.total_grade,
-                                   stu_total=len(self.stu_css),
-                                   gold_total=len(self.gold_css),
-                                   correct_num=self.correct_num,
-                                   units=self.stu_css)
+        return render('semantic/cs_report.html',
+                      date=self.creation_date,
+                      grade=self.grade,
+                      total_grade=self.total_grade,
+                      stu_total=len(self.stu_css),
+                      gold_total=len(self.gold_css),
+                      correct_num=self.correct_num,
+                      units=self.stu_css)
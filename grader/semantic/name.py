@@ -1,11 +1,13 @@
+import copy
 import datetime
 import logging
 import os
-from pathlib import Path
-import xml.etree.ElementTree as ET
-from jinja2 import Template
 
 from ..common import BaseReport, BaseGrader, Runner
+from ..common.golden import compile_golden
+from ..common.render import render
+from ..common.stream import iter_elements
+from ..common.util import match_records
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("NameResolve Grader")
@@ -17,37 +19,31 @@ class NameResolveGrader(BaseGrader):
 
     def grade_single(self, stu_out, gold_out) -> BaseReport:
         stu_names = self._parse_(stu_out)
-        gold_names = self._parse_(gold_out)
-
-        result = []
-        for gold_name in gold_names:
-            passed = False
-            for stu_name in stu_names:
-                if stu_name == gold_name:
-                    passed = True
-                    stu_name.passed = True
-                    gold_name.passed = True
-            result.append(passed)
+        # 缓存的记录被所有提交共享, 复制后再标记 passed
+        gold_names = [copy.copy(name) for name in compile_golden(gold_out, self._parse_)]
 
+        result = match_records(gold_names, stu_names)
         return NameReport(os.path.basename(gold_out), result, gold_names, stu_names)
 
     @staticmethod
     def _parse_(out_path):
         name = []
-        root = ET.parse(out_path).getroot()
-        for item in root.iter("def"):
-            name.append(Def(item.findtext('line'),
-                            item.findtext('type'),
-                            item.findtext('name')))
-        for item in root.iter("ref"):
-            name.append(Ref(item.findtext('line'),
-                            item.findtext('type'),
-                            item.findtext('name'),
-                            item.findtext('refLine')))
+        for item in iter_elements(out_path, ("def", "ref")):
+            if item.tag == 'def':
+                name.append(Def(item.findtext('line'),
+                                item.findtext('type'),
+                                item.findtext('name')))
+            else:
+                name.append(Ref(item.findtext('line'),
+                                item.findtext('type'),
+                                item.findtext('name'),
+                                item.findtext('refLine')))
         return name
 
 
 class Ref:
+    __slots__ = ('line', 'type', 'name', 'refLine', 'passed')
+
     def __init__(self, line, type, name, refLine):
         self.line = line
         self.type = type
@@ -58,11 +54,17 @@ class Ref:
     def __str__(self):
         return "Ref(line={0}, type={1},name={2}, refLine={3})".format(self.line, self.type, self.name, self.refLine)
 
+    @property
+    def key(self):
+        return Ref, self.line, self.type, self.name, self.refLine
+
     def __eq__(self, other):
         if type(other) != Ref:
             return False
-        return self.line == other.line and self.type == other.type and \
-               self.name == other.name and self.refLine == other.refLine
+        return self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
 
     @property
     def status(self):
@@ -70,6 +72,8 @@ class Ref:
 
 
 class Def:
+    __slots__ = ('line', 'type', 'name', 'passed')
+
     def __init__(self, line, type, name):
         self.line = line
         self.type = type
@@ -79,10 +83,17 @@ class Def:
     def __str__(self):
         return "Def(line={0}, type={1},name={2})".format(self.line, self.type, self.name)
 
+    @property
+    def key(self):
+        return Def, self.line, self.type, self.name
+
     def __eq__(self, other):
         if type(other) != Def:
             return False
-        return self.line == other.line and self.type == other.type and self.name == other.name
+        return self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
 
     @property
     def status(self):
@@ -116,12 +127,11 @@ class NameReport(BaseReport):
         return self.render()
 
     def render(self):
-        with open(os.path.join(Path(__file__).parent.absolute(), 'name_report.html'), 'r') as f:
-            template = Template(f.read(), lstrip_blocks=True, trim_blocks=True)
-            return template.render(date=self.creation_date,
-                                   grade=self.grade,
-                                   total_grade=self.total_grade,
-                                   stu_total=len(self.stu_names),
-                                   gold_total=len(self.gold_names),
-                                   correct_num=self.correct_num,
-                                   units=self.stu_names)
+        return render('semantic/name_report.html',
+                      date=self.creation_date,
+                      grade=self.grade,
+                      total_grade=self.total_grade,
+                      stu_total=len(self.stu_names),
+                      gold_total=len(self.gold_names),
+                      correct_num=self.correct_num,
+                      units=self.stu_names)
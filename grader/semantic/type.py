@@ -1,16 +1,21 @@
 import datetime
 import logging
 import os
-from pathlib import Path
-
-from jinja2 import Template
-from xmldiff import main, formatting
+from xml.etree.ElementTree import iterparse
 
 from ..common import Runner, BaseGrader, BaseReport
+from ..common.golden import compile_golden
+from ..common.render import render
+from ..common.tree import diff_files
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("Type Check Grader")
 
+# 类型标注所在的属性
+TYPE_ATTRIBUTE = 'evalType'
+# 是否在报告中附带 xmldiff 生成的全文差异, 大文件上 diff 很慢, 默认只比较类型标注
+RENDER_DIFF = False
+
 
 class TypeCheckGrader(BaseGrader):
 
@@ -18,17 +23,67 @@ class TypeCheckGrader(BaseGrader):
         return Runner(target='type', output_dir='type_out', output_extension='xml', logger=logger)
 
     def grade_single(self, stu_out, gold_out) -> BaseReport:
-        formatter = formatting.DiffFormatter()
-        diff = main.diff_files(stu_out, gold_out, formatter=formatter, diff_options={'F': 0.5})
-        return TypeCheckReport(os.path.basename(stu_out), diff)
+        gold_types = compile_golden(gold_out, annotation_index)
+        mismatches = compare_annotations(gold_types, annotation_index(stu_out))
+        diff, approximate = '', False
+        if mismatches and RENDER_DIFF:
+            result = diff_files(stu_out, gold_out)
+            diff, approximate = result.text, result.approximate
+        return TypeCheckReport(os.path.basename(stu_out), mismatches, len(gold_types), diff, approximate)
+
+
+def annotation_index(path):
+    """
+    读取 xml 中所有的类型标注, 返回 {结构路径: 类型}, 只遍历一遍.
+    结构路径形如 /TranslationUnit/FuncDecl[2]/body/Block[1]/..., 序号是同名兄弟节点中的位置,
+    某处多出或缺少其他节点不会影响别处的路径.
+    """
+    index = {}
+    # 路径上的 (元素, 路径, 子节点各 tag 的计数)
+    stack = []
+    for event, element in iterparse(path, events=('start', 'end')):
+        if event == 'start':
+            if stack:
+                parent_path, counts = stack[-1][1], stack[-1][2]
+                counts[element.tag] = counts.get(element.tag, 0) + 1
+                node_path = '{0}/{1}[{2}]'.format(parent_path, element.tag, counts[element.tag])
+            else:
+                node_path = '/' + element.tag
+            stack.append((element, node_path, {}))
+            value = element.get(TYPE_ATTRIBUTE)
+            if value is not None:
+                index[node_path] = value
+        else:
+            stack.pop()
+            if stack:
+                stack[-1][0].remove(element)
+    return index
+
+
+def compare_annotations(gold_types, stu_types):
+    """
+    逐个路径比较类型标注, 返回 [(路径, 标准类型, 学生类型)], 缺少的一方为 None.
+    标准答案中的标注按文档顺序在前, 学生多出的标注在后.
+    """
+    mismatches = [(path, value, stu_types.get(path)) for path, value in gold_types.items()
+                  if stu_types.get(path) != value]
+    mismatches += [(path, None, value) for path, value in stu_types.items() if path not in gold_types]
+    return mismatches
 
 
 class TypeCheckReport(BaseReport):
 
-    def __init__(self, report_name, diff):
+    def __init__(self, report_name, mismatches, annotations, diff='', approximate=False):
         self._report_name = report_name
         self.creation_date = datetime.datetime.now()
+        self.mismatches = mismatches
+        # 标准答案中类型标注的个数, 以及学生多出的标注个数
+        self.annotations = annotations
+        self.extra = sum(1 for mismatch in mismatches if mismatch[1] is None)
+        # 只在 RENDER_DIFF 时生成
         self.diff = diff
+        # diff 超出预算, 是哈希匹配得到的概要
+        self.approximate = approximate
 
     @property
     def report_name(self):
@@ -40,12 +95,19 @@ class TypeCheckReport(BaseReport):
 
     @property
     def grade(self):
-        return 100 if self.diff == '' else 0
+        # 学生多出的标注也算作错误, 向下取整, 有错误时不会得满分
+        total = self.annotations + self.extra
+        if total == 0:
+            return 100
+        return 100 * (total - len(self.mismatches)) // total
 
     @property
     def detail(self):
-        with open(os.path.join(Path(__file__).parent.absolute(), 'type_report.html'), 'r') as f:
-            template = Template(f.read(), lstrip_blocks=True, trim_blocks=True)
-            return template.render(date=self.creation_date,
-                                   status="passed" if self.grade == 100 else "not passed",
-                                   detail=self.diff if self.diff != '' else "null")
+        return render('semantic/type_report.html',
+                      date=self.creation_date,
+                      status="passed" if not self.mismatches else "not passed",
+                      passed=self.annotations + self.extra - len(self.mismatches),
+                      annotations=self.annotations,
+                      mismatches=self.mismatches,
+                      approximate=self.approximate,
+                      diff=self.diff)
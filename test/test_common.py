@@ -0,0 +1,477 @@
+import logging
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+from grader.common import Runner, Task, Scheduler, Grader, ErrorReport, Submission, gather
+from grader.common import golden, render
+from grader.common.failfast import FailFastPolicy
+from grader.common.journal import Journal
+from grader.common.process import execute, ResourceUsage, BoundedBuffer
+from grader.common.stream import iter_elements
+from grader.common.timeout import TimeoutPolicy
+from grader.common.tree import diff_files, tree_digest
+from grader.common.cache import ResultCache
+from grader.common.cds import CDSArchive
+from grader.common.util import load_json
+from grader.lex import LexerGrader
+from grader.parse import ParserGrader
+from grader.pipeline import Pipeline, load_submissions
+
+# 模拟学生程序: 把输入文件复制到输出文件
+FAKE_APP = "import sys, shutil, time; time.sleep(0.1); shutil.copy(sys.argv[1], sys.argv[sys.argv.index('-o') + 1])"
+
+
+# 模拟正确的学生程序: 输出与 gold 目录中的标准答案相同
+COPY_GOLD_APP = "import sys, shutil; code = sys.argv[1]; " \
+                "shutil.copy(code.replace('/code/', '/golden/')[:-2] + '.xml', sys.argv[sys.argv.index('-o') + 1])"
+
+
+class FakeRunner(Runner):
+    def _cmd_(self, app_path, app_args, limit=None, submission=None):
+        return [sys.executable, '-c', FAKE_APP] + app_args
+
+
+class ScriptRunner(Runner):
+    def __init__(self, script, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.script = script
+
+    def _cmd_(self, app_path, app_args, limit=None, submission=None):
+        return [sys.executable, '-c', self.script] + app_args
+
+
+class RunnerTestCase(unittest.TestCase):
+    def test_run_parallel(self):
+        with tempfile.TemporaryDirectory() as serial_dir, tempfile.TemporaryDirectory() as parallel_dir:
+            serial = FakeRunner('lex', 'lex_out', 'xml', logging.getLogger('test'))
+            parallel = FakeRunner('lex', 'lex_out', 'xml', logging.getLogger('test'), workers=4)
+            serial_out = serial.run('fake.jar', '../public/code/lexer', serial_dir)
+            parallel_out = parallel.run('fake.jar', '../public/code/lexer', parallel_dir)
+
+            self.assertEqual(sorted(os.listdir(serial_out)), sorted(os.listdir(parallel_out)))
+            for name in os.listdir(serial_out):
+                if name.endswith('.json'):
+                    serial_status = load_json(os.path.join(serial_out, name))
+                    parallel_status = load_json(os.path.join(parallel_out, name))
+                    # 资源占用每次执行都不同
+                    self.assertIn('usage', serial_status)
+                    serial_status.pop('usage')
+                    parallel_status.pop('usage')
+                    self.assertEqual(serial_status, parallel_status)
+
+
+class ExecuteTestCase(unittest.TestCase):
+    def test_usage(self):
+        execution = execute([sys.executable, '-c', 'import sys; data = bytearray(32 << 20); print(sys.stdin.read())'],
+                            b'hello')
+        self.assertEqual(0, execution.return_code)
+        self.assertEqual(b'hello', execution.stdout.strip())
+        self.assertFalse(execution.timed_out)
+        self.assertGreater(execution.usage.wall_time, 0)
+        self.assertGreater(execution.usage.user_time + execution.usage.sys_time, 0)
+        self.assertGreater(execution.usage.max_rss, 32 << 20)
+
+    def test_bounded_output(self):
+        execution = execute([sys.executable, '-c',
+                             'import sys; sys.stdout.buffer.write(b"\\xff" + b"x" * (8 << 20) + b"end")'],
+                            max_output=1024)
+        self.assertLess(len(execution.stdout), 1100)
+        self.assertTrue(execution.stdout.endswith(b'end'))
+        self.assertIn('[truncated', execution.stdout.decode('utf-8', errors='replace'))
+
+    def test_bounded_buffer(self):
+        buffer = BoundedBuffer(8)
+        for chunk in (b'abc', b'defgh', b'ijklmn'):
+            buffer.write(chunk)
+        self.assertEqual(6, buffer.truncated)
+        self.assertEqual(b'abcd\n... [truncated 6 bytes] ...\nklmn', buffer.getvalue())
+
+        buffer = BoundedBuffer(8)
+        buffer.write(b'abcdefgh')
+        self.assertEqual(b'abcdefgh', buffer.getvalue())
+
+    def test_timeout(self):
+        execution = execute([sys.executable, '-c', 'import time; time.sleep(10)'], timeout=0.5)
+        self.assertTrue(execution.timed_out)
+        self.assertLess(execution.usage.wall_time, 5)
+
+    def test_stop(self):
+        chunks = []
+
+        def on_stdout(chunk):
+            chunks.append(chunk)
+            return b'stop' not in chunk
+
+        execution = execute([sys.executable, '-c', 'import sys, time; print("stop", flush=True); time.sleep(10)'],
+                            timeout=5, on_stdout=on_stdout)
+        self.assertTrue(execution.stopped)
+        self.assertFalse(execution.timed_out)
+        self.assertLess(execution.usage.wall_time, 4)
+        self.assertEqual(b''.join(chunks), execution.stdout)
+
+
+class CDSTestCase(unittest.TestCase):
+    def test_probe_budget(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            # 一直不退出的 java
+            java = os.path.join(tmp, 'java')
+            with open(java, 'w') as f:
+                f.write('#!/bin/sh\nexec sleep 10\n')
+            os.chmod(java, 0o755)
+            jar = os.path.join(tmp, 'a.jar')
+            open(jar, 'w').close()
+            path = os.environ['PATH']
+            os.environ['PATH'] = tmp + os.pathsep + path
+            try:
+                cds = CDSArchive(os.path.join(tmp, 'cds'))
+                submission = Submission(jar)
+                # 预算已耗尽: 不探测, 也不记录, 之后的运行可以再生成
+                self.assertEqual([], cds.vm_args(jar, [], limit=lambda: 0, submission=submission))
+                self.assertIsNone(cds.record(jar))
+                self.assertEqual(0, submission.spent)
+
+                start = time.perf_counter()
+                self.assertEqual([], cds.vm_args(jar, [], limit=lambda: 0.3, submission=submission))
+                self.assertLess(time.perf_counter() - start, 5)
+                self.assertIn('error', cds.record(jar))
+                self.assertGreaterEqual(submission.spent, 0.3)
+            finally:
+                os.environ['PATH'] = path
+
+
+    def test_key(self):
+        # JVM 会拒绝路径或修改时间不同的归档, 内容相同也不能共用
+        with tempfile.TemporaryDirectory() as tmp:
+            cds = CDSArchive(os.path.join(tmp, 'cds'))
+            jar, copy = os.path.join(tmp, 'a.jar'), os.path.join(tmp, 'b.jar')
+            for path in (jar, copy):
+                with open(path, 'w') as f:
+                    f.write('jar')
+            with open(os.path.join(cds.archive_dir, cds._key_(jar) + '.json'), 'w') as f:
+                f.write('{"error": "failed"}')
+            self.assertIsNotNone(cds.record(jar))
+            self.assertIsNone(cds.record(copy))
+            stat = os.stat(jar)
+            os.utime(jar, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+            self.assertIsNone(cds.record(jar))
+
+
+class TimeoutPolicyTestCase(unittest.TestCase):
+    def test_calibrate(self):
+        with tempfile.TemporaryDirectory() as gold_dir:
+            submission = Submission('ref.jar')
+            calibration = TimeoutPolicy(calibrate=True)
+            calibration.charge(submission, gold_dir, 'if', ResourceUsage(wall_time=0.5))
+            calibration.save()
+
+            policy = TimeoutPolicy(factor=3, margin=2, default=10, overrides={'interpret': 4})
+            self.assertAlmostEqual(3.5, policy.timeout('parse', gold_dir, 'if'))
+            self.assertEqual(10, policy.timeout('parse', gold_dir, 'while'))
+            self.assertEqual(4, policy.timeout('interpret', gold_dir, 'if'))
+
+    def test_budget(self):
+        policy = TimeoutPolicy(default=10, budget=12)
+        submission = Submission('stu.jar')
+        self.assertEqual(10, policy.limit(submission, 'lex', '', 'keyword'))
+        policy.charge(submission, '', 'keyword', ResourceUsage(wall_time=10))
+        self.assertEqual(2, policy.limit(submission, 'lex', '', 'identifier'))
+        policy.charge(submission, '', 'identifier', ResourceUsage(wall_time=2))
+        self.assertEqual(0, policy.limit(submission, 'lex', '', 'punctuator'))
+
+    def test_reserve(self):
+        # 并发的执行各自预留超时时间, 合计不超过预算
+        policy = TimeoutPolicy(default=10, budget=12)
+        submission = Submission('stu.jar')
+        self.assertEqual(10, policy.limit(submission, 'lex', '', 'keyword', reserve=True))
+        self.assertEqual(2, policy.limit(submission, 'lex', '', 'identifier', reserve=True))
+        self.assertEqual(0, policy.limit(submission, 'lex', '', 'punctuator'))
+        policy.charge(submission, '', 'keyword', ResourceUsage(wall_time=1))
+        self.assertEqual(9, policy.limit(submission, 'lex', '', 'punctuator'))
+        policy.charge(submission, '', 'identifier', ResourceUsage(wall_time=2))
+        self.assertEqual(9, policy.limit(submission, 'lex', '', 'punctuator'))
+        self.assertEqual({}, submission.reserved)
+
+
+class FailFastTestCase(unittest.TestCase):
+    def test_same_startup_error(self):
+        policy = FailFastPolicy(threshold=2)
+        submission = Submission('broken.jar')
+        policy.observe(submission, 'lex', 'a.c', 1, 'Error: Could not find or load main class Main')
+        self.assertIsNone(policy.check(submission, 'lex'))
+        policy.observe(submission, 'lex', 'b.c', 1, 'Error: Could not find or load main class Main')
+        return_code, stderr = policy.check(submission, 'lex')
+        self.assertEqual(1, return_code)
+        self.assertTrue(stderr.startswith('Error: Could not find or load main class Main'))
+
+    def test_test_case_in_error(self):
+        policy = FailFastPolicy(threshold=2)
+        submission = Submission('broken.jar')
+        policy.observe(submission, 'lex', 'code/a.c', 1, 'Exception while compiling code/a.c')
+        policy.observe(submission, 'lex', 'code/b.c', 1, 'Exception while compiling code/b.c')
+        self.assertIsNotNone(policy.check(submission, 'lex'))
+
+    def test_success_disarms(self):
+        policy = FailFastPolicy(threshold=2)
+        submission = Submission('partial.jar')
+        policy.observe(submission, 'lex', 'a.c', 1, 'NullPointerException')
+        policy.observe(submission, 'lex', 'b.c', 0, '')
+        policy.observe(submission, 'lex', 'c.c', 1, 'NullPointerException')
+        policy.observe(submission, 'lex', 'd.c', 1, 'NullPointerException')
+        self.assertIsNone(policy.check(submission, 'lex'))
+
+    def test_stages_apart(self):
+        # lex 阶段启动即失败, parse 阶段正确: 不能因为 lex 跳过 parse 的执行
+        policy = FailFastPolicy(threshold=2)
+        lex = LexerGrader('../public/code/lexer', '../public/golden/lexer', fail_fast=policy)
+        lex.runner = ScriptRunner("import sys; sys.exit('Error: Could not find or load main class Main')",
+                                  'lex', 'lex_out', 'xml', logging.getLogger('test'))
+        parse = ParserGrader('../public/code/parse', '../public/golden/parse', fail_fast=policy)
+        parse.runner = ScriptRunner(COPY_GOLD_APP, 'parse', 'parse_out', 'xml', logging.getLogger('test'))
+        with tempfile.TemporaryDirectory() as tmp:
+            jar = os.path.join(tmp, 'a.jar')
+            open(jar, 'w').close()
+            reports = Pipeline([lex, parse], 1).grade(jar)
+
+        lex_count = len([name for name in os.listdir('../public/golden/lexer') if name.endswith('.xml')])
+        lex_reports, parse_reports = reports[:lex_count], reports[lex_count:]
+        self.assertEqual([0] * lex_count, [report.grade for report in lex_reports])
+        self.assertTrue(any('not executed' in report.detail for report in lex_reports))
+        self.assertEqual([100] * len(parse_reports), [report.grade for report in parse_reports])
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    def test_hit_without_running(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            jar = os.path.join(tmp, 'fake.jar')
+            with open(jar, 'w') as f:
+                f.write('jar')
+            cache = ResultCache(os.path.join(tmp, 'cache'))
+            runner = FakeRunner('lex', 'lex_out', 'xml', logging.getLogger('test'), cache=cache)
+            first_out = runner.run(jar, '../public/code/lexer', os.path.join(tmp, 'first'))
+            self.assertEqual(0, cache.stats['hits'])
+
+            runner._cmd_ = lambda *args: self.fail('cache hit should not spawn a process')
+            second_out = runner.run(jar, '../public/code/lexer', os.path.join(tmp, 'second'))
+            self.assertEqual(cache.stats['misses'], cache.stats['hits'])
+            for name in os.listdir(first_out):
+                with open(os.path.join(first_out, name)) as a, open(os.path.join(second_out, name)) as b:
+                    self.assertEqual(a.read(), b.read())
+
+    def test_hit_within_budget(self):
+        # 全部命中缓存的重新评测不启动进程, 不受预算限制, 也不消耗预算
+        with tempfile.TemporaryDirectory() as tmp:
+            jar = os.path.join(tmp, 'a.jar')
+            open(jar, 'w').close()
+            cache = ResultCache(os.path.join(tmp, 'cache'))
+            grader = ParserGrader('../public/code/parse', '../public/golden/parse', cache=cache)
+            grader.runner = ScriptRunner(COPY_GOLD_APP, 'parse', 'parse_out', 'xml', logging.getLogger('test'),
+                                         cache=cache)
+            grader.grade(jar)
+
+            grader.timeouts = TimeoutPolicy(budget=2.0)
+            grader.runner._cmd_ = lambda *args: self.fail('cache hit should not spawn a process')
+            # 预算已经用完
+            submission = Submission(jar)
+            submission.spent = 2.0
+            reports = [task.grade([task.runs[0]()]) for task in grader.tasks(submission)]
+            self.assertEqual([100] * len(reports), [report.grade for report in reports])
+            self.assertEqual(2.0, submission.spent)
+
+    def test_lru_eviction(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ResultCache(tmp, max_size=150)
+            for key in ('a', 'b', 'c'):
+                cache.put(key, os.path.join(tmp, 'missing.xml'), {"stdout": 'x' * 40})
+                cache.get('a', os.path.join(tmp, 'missing.xml'))
+            self.assertIsNotNone(cache.get('a', os.path.join(tmp, 'missing.xml')))
+            self.assertIsNone(cache.get('b', os.path.join(tmp, 'missing.xml')))
+            self.assertLessEqual(cache.stats["size"], 150)
+
+
+compiled = []
+
+
+def compile_lines(path):
+    compiled.append(path)
+    with open(path) as f:
+        return f.read().split()
+
+
+class GoldenTestCase(unittest.TestCase):
+    def test_compile_golden(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            gold = os.path.join(tmp, 'a.xml')
+            with open(gold, 'w') as f:
+                f.write('a b')
+            compiled.clear()
+            cache_dir = golden.CACHE_DIR
+            golden.CACHE_DIR = os.path.join(tmp, 'cache')
+            try:
+                self.assertEqual(['a', 'b'], golden.compile_golden(gold, compile_lines))
+                self.assertEqual(['a', 'b'], golden.compile_golden(gold, compile_lines))
+                self.assertEqual(1, len(os.listdir(golden.CACHE_DIR)))
+                # 不写入 gold 目录
+                self.assertEqual(['a.xml', 'cache'], sorted(os.listdir(tmp)))
+                # 其他进程直接读取缓存文件
+                golden._memo.clear()
+                self.assertEqual(['a', 'b'], golden.compile_golden(gold, compile_lines))
+                self.assertEqual(1, len(compiled))
+
+                with open(gold, 'w') as f:
+                    f.write('a b c')
+                self.assertEqual(['a', 'b', 'c'], golden.compile_golden(gold, compile_lines))
+                self.assertEqual(2, len(compiled))
+            finally:
+                golden.CACHE_DIR = cache_dir
+
+    def test_tree_digest(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            def digest(text):
+                path = os.path.join(tmp, 'tree.xml')
+                with open(path, 'w') as f:
+                    f.write(text)
+                return tree_digest(path)
+
+            expected = digest('<a>\n  <b x="1" y="2">t</b>\n  <c/>\n</a>')
+            self.assertEqual(expected, digest('<a><b y="2" x="1">t</b><c/></a>'))
+            self.assertNotEqual(expected, digest('<a><b x="1" y="2"> t</b><c/></a>'))
+            self.assertNotEqual(expected, digest('<a><c/><b x="1" y="2">t</b></a>'))
+
+    def test_diff_budget(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            stu, gold = os.path.join(tmp, 'stu.xml'), os.path.join(tmp, 'gold.xml')
+            with open(stu, 'w') as f:
+                f.write('<a><b x="1">t</b><c/><d/></a>')
+            with open(gold, 'w') as f:
+                f.write('<a><b x="2">t</b><c/><e/></a>')
+            exact = diff_files(stu, gold)
+            self.assertFalse(exact.approximate)
+            for approximate in (diff_files(stu, gold, max_nodes=1), diff_files(stu, gold, max_seconds=0)):
+                self.assertTrue(approximate.approximate)
+                self.assertEqual(['[delete, /a/d[1]]',
+                                  '[insert, /a[1], e, 2]',
+                                  '[update-attribute, /a/b[1], x, "2"]'], approximate.text.split('\n'))
+
+
+class StreamTestCase(unittest.TestCase):
+    def test_iter_elements(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'out.xml')
+            with open(path, 'w') as f:
+                f.write('<root><scope><ref><line>2</line></ref><def><line>1</line></def></scope>'
+                        '<def><line>3</line><def><line>4</line></def></def><other/></root>')
+            items = [(item.tag, item.findtext('line')) for item in iter_elements(path, ('def', 'ref'))]
+            # 文档顺序, 嵌套的元素先于外层元素结束
+            self.assertEqual([('ref', '2'), ('def', '1'), ('def', '4'), ('def', '3')], items)
+
+
+class RenderTestCase(unittest.TestCase):
+    def test_bytecode_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            bytecode_cache = render.environment.bytecode_cache
+            render.environment.cache.clear()
+            try:
+                render.use_bytecode_cache(tmp)
+                template = render.environment.get_template('ir/report.html')
+                self.assertIs(template, render.environment.get_template('ir/report.html'))
+                self.assertEqual(1, len(os.listdir(tmp)))
+            finally:
+                render.environment.bytecode_cache = bytecode_cache
+
+
+class SchedulerTestCase(unittest.TestCase):
+    def test_grade_after_runs(self):
+        def run(i):
+            time.sleep(0.05 * (3 - i))
+            return i
+
+        with Scheduler(4) as scheduler:
+            futures = [scheduler.submit(Task('test', str(n), [lambda i=i: run(i) for i in range(3)],
+                                             lambda results, n=n: (n, results)))
+                       for n in range(4)]
+            self.assertEqual([(n, [0, 1, 2]) for n in range(4)], [future.result() for future in futures])
+
+    def test_run_error(self):
+        def fail():
+            raise OSError('spawn failed')
+
+        with Scheduler(2) as scheduler:
+            future = scheduler.submit(Task('test', 'error', [fail, fail], lambda results: results))
+            self.assertRaises(OSError, future.result)
+
+    def test_gather(self):
+        with Scheduler(2) as scheduler:
+            futures = [scheduler.submit(Task('test', str(n), [lambda n=n: n], lambda results: results[0]))
+                       for n in range(5)]
+            self.assertEqual(list(range(5)), gather(futures).result())
+
+
+class BatchTestCase(unittest.TestCase):
+    def test_load_submissions(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ('b/b.jar', 'a/a.jar', 'a/notes.txt'):
+                os.makedirs(os.path.join(tmp, os.path.dirname(name)), exist_ok=True)
+                open(os.path.join(tmp, name), 'w').close()
+            manifest = os.path.join(tmp, 'manifest.txt')
+            with open(manifest, 'w') as f:
+                f.write('# class 1\nb/b.jar\n\na/a.jar\n')
+
+            from_dir = load_submissions(tmp)
+            self.assertEqual([os.path.join(tmp, 'a', 'a.jar'), os.path.join(tmp, 'b', 'b.jar')],
+                             [submission.path for submission in from_dir])
+            self.assertEqual(os.path.join(tmp, 'a', 'a'), from_dir[0].out_dir)
+            self.assertEqual([os.path.join(tmp, 'b', 'b.jar'), os.path.join(tmp, 'a', 'a.jar')],
+                             [submission.path for submission in load_submissions(manifest)])
+
+
+class CountingGrader(Grader):
+    def __init__(self):
+        super().__init__('', '')
+        self.runs = 0
+
+    def run(self):
+        self.runs += 1
+        return self.runs
+
+    def tasks(self, submission):
+        return [Task('count', str(n), [self.run], lambda results, n=n: ErrorReport(str(n), 100, 'ok'))
+                for n in range(3)]
+
+
+class JournalTestCase(unittest.TestCase):
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            jar = os.path.join(tmp, 'a.jar')
+            open(jar, 'w').close()
+            journal = Journal(os.path.join(tmp, 'journal.db'))
+            grader = CountingGrader()
+            pipeline = Pipeline([grader], 2, journal)
+
+            first = pipeline.grade(jar)
+            second = pipeline.grade(jar)
+            journal.close()
+            self.assertEqual(3, grader.runs)
+            self.assertEqual([(r.report_name, r.detail) for r in first], [(r.report_name, r.detail) for r in second])
+
+    def test_record_streamed_detail(self):
+        class StreamedReport(ErrorReport):
+            @property
+            def detail(self):
+                raise AssertionError('detail should not be rendered as a whole')
+
+            def write_detail(self, out):
+                for part in ('a', 'b', 'c'):
+                    out.write(part)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            journal = Journal(os.path.join(tmp, 'journal.db'))
+            journal.record('a.jar', 'lex', 'x', StreamedReport('x', 100, ''))
+            self.assertEqual('abc', journal.get('a.jar', 'lex', 'x').detail)
+            journal.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,11 @@
+import os
+import shutil
+import tempfile
 import unittest
 
-from grader.ir import IRGrader
+from grader.common.failfast import FailFastPolicy
+from grader.ir import IRGrader, load_test_data
+from grader.ir.compare import OutputComparator
 
 
 class MyTestCase(unittest.TestCase):
@@ -11,5 +16,78 @@ class MyTestCase(unittest.TestCase):
             print(report.detail)
 
 
+class FailFastTestCase(unittest.TestCase):
+    def test_runtime_error_of_one_program(self):
+        # fib 的每个输入都触发同样的运行时错误, 次数达到阈值, 但不能因此跳过 gcd
+        with tempfile.TemporaryDirectory() as tmp:
+            java = os.path.join(tmp, 'java')
+            with open(java, 'w') as f:
+                f.write('#!/bin/sh\n'
+                        'case "$*" in *fib.c) echo "java.lang.ArithmeticException: / by zero" >&2; exit 1;; esac\n'
+                        'echo 0\n')
+            os.chmod(java, 0o755)
+            jar = os.path.join(tmp, 'a.jar')
+            open(jar, 'w').close()
+            path = os.environ['PATH']
+            os.environ['PATH'] = tmp + os.pathsep + path
+            try:
+                grader = IRGrader('../public/code/ir', '../public/golden/ir', fail_fast=FailFastPolicy(threshold=3))
+                fib, gcd = grader.grade(jar)
+            finally:
+                os.environ['PATH'] = path
+            self.assertEqual(3, fib.re_num)
+            self.assertEqual(gcd.num_test_cases, gcd.wa_num)
+            self.assertFalse(any('not executed' in msg for msg in gcd.msgs))
+
+
+class TestDataTestCase(unittest.TestCase):
+    def test_load_once(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = os.path.join(tmp, 'fib')
+            shutil.copytree('../public/code/ir/fib', data_dir)
+            data = load_test_data(data_dir)
+            self.assertEqual(['test1', 'test2', 'test3'], [item.name for item in data])
+            self.assertIs(data, load_test_data(data_dir))
+
+            with open(os.path.join(data_dir, 'output', 'test2.out'), 'a') as f:
+                f.write('\n1\n')
+            reloaded = load_test_data(data_dir)
+            self.assertIsNot(data, reloaded)
+            self.assertTrue(reloaded[1].expected.endswith('\n1'))
+
+
+class OutputComparatorTestCase(unittest.TestCase):
+    def feed(self, expected, chunks, limit=1 << 20):
+        comparator = OutputComparator(expected, limit)
+        for chunk in chunks:
+            if not comparator.write(chunk):
+                break
+        return comparator
+
+    def test_same(self):
+        # 首尾空白被忽略, \r\n 可能被分在两块中
+        comparator = self.feed('1\n2\n3', [b'\n 1\r', b'\n2', b'\r\n3', b'\r\n\t\n'])
+        self.assertIsNone(comparator.difference)
+        self.assertFalse(comparator.undecided)
+
+    def test_difference(self):
+        comparator = self.feed('1\n2\n3', [b'1\n', b'2\n4\n'])
+        self.assertEqual(4, comparator.difference)
+        self.assertEqual(3, comparator.line(comparator.difference))
+        # 标准输出之后只能是空白
+        self.assertEqual(5, self.feed('1\n2\n3', [b'1\n2\n3\n', b'\n4']).difference)
+
+    def test_exceeded(self):
+        comparator = self.feed('1', [b'1'] + [b' ' * 10] * 3, limit=16)
+        self.assertTrue(comparator.exceeded)
+        self.assertEqual(1, comparator.difference)
+
+    def test_undecided(self):
+        # 结尾的 \xa0 是否为空白由最终的完整比较决定
+        comparator = self.feed('1', ['1\xa0'.encode('utf-8')])
+        self.assertIsNone(comparator.difference)
+        self.assertTrue(comparator.undecided)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,10 +1,14 @@
 import logging
+import os
+import tempfile
 import unittest
 
 import untangle
 
 from grader.lex import LexerGrader, Runner
-from grader.common.lcs import lcs
+from grader.lex.report import AnalysisUnit, collapse_correct
+from grader.lex.token import Token, read_tokens
+from grader.common.lcs import lcs, myers
 
 
 class RunnerTestCase(unittest.TestCase):
@@ -21,6 +25,15 @@ class XMLTestCase(unittest.TestCase):
         stu_tokens = untangle.parse(stu_xml).tokens.token
         print(stu_tokens[0].value.cdata)
 
+    def test_read_tokens(self):
+        gold_xml = '../public/golden/lexer/float_literal.xml'
+        expected = untangle.parse(gold_xml).tokens.token
+        tokens = read_tokens(gold_xml)
+        self.assertEqual(len(expected), len(tokens))
+        for element, token in zip(expected, tokens):
+            for name in Token.FIELDS:
+                self.assertEqual(getattr(element, name).cdata, getattr(token, name))
+
 
 class LexerTestCase(unittest.TestCase):
     def test_grade_single(self):
@@ -29,6 +42,24 @@ class LexerTestCase(unittest.TestCase):
         result = LexerGrader('', '').grade_single(stu_xml, gold_xml)
         print(result.render())
 
+    def test_grade_empty(self):
+        gold_xml = '../public/golden/lexer/float_literal.xml'
+        with tempfile.TemporaryDirectory() as tmp:
+            stu_xml = os.path.join(tmp, 'float_literal.xml')
+            with open(stu_xml, 'w') as f:
+                f.write('<tokens></tokens>')
+            report = LexerGrader('', '').grade_single(stu_xml, gold_xml)
+        self.assertEqual(0, report.grade)
+        self.assertIn('float_literal', report.detail)
+
+    def test_grade_batch(self):
+        gold_xml = '../public/golden/lexer/float_literal.xml'
+        stu_xmls = ['../public/golden/lexer/float_literal.xml', '../public/golden/lexer/int_literal.xml']
+        expected = [LexerGrader('', '').grade_single(stu_xml, gold_xml).grade for stu_xml in stu_xmls]
+        for workers in (1, 2):
+            reports = LexerGrader('', '').grade_batch(stu_xmls, gold_xml, workers)
+            self.assertEqual(expected, [report.grade for report in reports])
+
     def test_run(self):
         grader = LexerGrader('../public/code/lexer', '../public/golden/lexer')
         reports = grader.grade('../solution/yan-ycc-impl-1.0-SNAPSHOT-jar-with-dependencies-bad.jar')
@@ -36,6 +67,15 @@ class LexerTestCase(unittest.TestCase):
             print(report.detail)
 
 
+class CollapseTestCase(unittest.TestCase):
+    def test_collapse_correct(self):
+        statuses = ['error'] + ['correct'] * 3 + ['missing'] + ['correct'] * 5
+        units = [AnalysisUnit(status, None) for status in statuses]
+        rows = [(index, unit.status, count) for index, unit, count in collapse_correct(units, 4)]
+        self.assertEqual([(1, 'error', 1), (2, 'correct', 1), (3, 'correct', 1), (4, 'correct', 1),
+                          (5, 'missing', 1), (6, 'correct', 5)], rows)
+
+
 class LCSTestCase(unittest.TestCase):
     def test_lcs1(self):
         a = [1, 2, 3, 4, 5, 6, 7]
@@ -49,6 +89,48 @@ class LCSTestCase(unittest.TestCase):
         result = lcs(a, b)
         self.assertEqual([(0, 0), (1, 2), (2, 4), (3, 5), (4, 7), (5, 8)], result)
 
+    def test_lcs_key(self):
+        a = ['a', 'B', 'c']
+        b = ['A', 'x', 'b', 'C']
+        self.assertEqual([(0, 0), (1, 2), (2, 3)], lcs(a, b, key=str.lower))
+        self.assertEqual(lcs(a, b, key=str.lower), lcs(a, b, lambda x, y: x.lower() == y.lower()))
+
+    def test_myers(self):
+        import random
+        rnd = random.Random(0)
+        for _ in range(500):
+            a = [rnd.randrange(4) for _ in range(rnd.randrange(30))]
+            b = [x for x in a if rnd.random() < 0.9] + [rnd.randrange(4) for _ in range(rnd.randrange(3))]
+            self.assertEqual(lcs(a, b), myers(a, b))
+            # 超过 max_d 时退回 lcs
+            self.assertEqual(lcs(a, b), myers(a, b, max_d=1))
+
+    def test_lcs_linear_space(self):
+        import grader.common.lcs as module
+        a = [1, 2, 3, 4, 5, 6, 7] * 20
+        b = [1, 0, 2, 4, 3, 4, 7, 5, 6, 7] * 20
+        expected = lcs(a, b)
+        limit, module.MAX_TABLE_BYTES = module.MAX_TABLE_BYTES, 16
+        try:
+            result = lcs(a, b)
+        finally:
+            module.MAX_TABLE_BYTES = limit
+        self.assertEqual(expected, result)
+
+    def test_lcs_checkpoint(self):
+        # 超过 MAX_TABLE_BYTES 时与完整表格的回溯结果相同, 包括等长的多个最优解中的选择
+        import random
+        import grader.common.lcs as module
+        rnd = random.Random(0)
+        cases = [([rnd.randrange(3) for _ in range(rnd.randrange(80))],
+                  [rnd.randrange(3) for _ in range(rnd.randrange(80))]) for _ in range(200)]
+        expected = [lcs(a, b) for a, b in cases]
+        limit, module.MAX_TABLE_BYTES = module.MAX_TABLE_BYTES, 4
+        try:
+            self.assertEqual(expected, [lcs(a, b) for a, b in cases])
+        finally:
+            module.MAX_TABLE_BYTES = limit
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,5 +1,10 @@
+import os
+import tempfile
 import unittest
 
+from lxml import etree
+from xmldiff import main, formatting
+
 from grader.parse import Runner, ParserGrader
 import logging
 
@@ -20,6 +25,40 @@ class ParserGraderTestCase(unittest.TestCase):
         report = grader.grade_single(stu_xml, gold_xml)
         print(report.detail)
 
+    def test_grade_changed(self):
+        gold_xml = '../public/golden/parse/if.xml'
+        with open(gold_xml) as f:
+            content = f.read()
+        with tempfile.TemporaryDirectory() as tmp:
+            stu_xml = os.path.join(tmp, 'if.xml')
+            with open(stu_xml, 'w') as f:
+                f.write(content.replace('<Literal type="INT">10</Literal>', '<Literal type="INT">11</Literal>', 1))
+            report = ParserGrader('', '').grade_single(stu_xml, gold_xml)
+            expected = main.diff_files(stu_xml, gold_xml, formatter=formatting.DiffFormatter(),
+                                       diff_options={'F': 0.5})
+            self.assertEqual(expected, report.diff)
+            self.assertEqual(0, report.grade)
+            self.assertTrue(0 < report.similarity < 1)
+
+            report = ParserGrader('', '').grade_single(gold_xml, gold_xml)
+            self.assertEqual(100, report.grade)
+            self.assertEqual(1, report.similarity)
+
+    def test_grade_deleted(self):
+        # 删除函数名: 子树的 diff 会报告为插入, 整棵树的 diff 把别处同名的节点移过来
+        gold_xml = '../public/golden/parse/all.xml'
+        tree = etree.parse(gold_xml)
+        name = tree.getroot().find('FuncDecl').find('name')
+        name.getparent().remove(name)
+        with tempfile.TemporaryDirectory() as tmp:
+            stu_xml = os.path.join(tmp, 'all.xml')
+            tree.write(stu_xml)
+            report = ParserGrader('', '').grade_single(stu_xml, gold_xml)
+            expected = main.diff_files(stu_xml, gold_xml, formatter=formatting.DiffFormatter(),
+                                       diff_options={'F': 0.5})
+            self.assertIn('[move, ', expected)
+            self.assertEqual(expected, report.diff)
+
     def test_all(self):
         grader = ParserGrader('../public/code/parse', '../public/golden/parse')
         reports = grader.grade('../solution/yan-ycc-impl-1.0-SNAPSHOT-jar-with-dependencies.jar')
@@ -1,13 +1,48 @@
 import logging
+import os
+import tempfile
 import unittest
 
 from grader.common import Runner
 from grader.semantic import SemanticGrader
 from grader.semantic.cs import ControlStructureGrader
-from grader.semantic.name import NameResolveGrader
+from grader.common.util import match_records
+from grader.semantic.name import NameResolveGrader, Def, Ref
 from grader.semantic.type import TypeCheckGrader
 
 
+class MatchTestCase(unittest.TestCase):
+    def test_match_records(self):
+        gold = [Def('1', 'int', 'a'), Def('1', 'int', 'a'), Ref('2', 'int', 'a', '1'), Def('3', 'int', 'b')]
+        stu = [Ref('2', 'int', 'a', '1'), Def('1', 'int', 'a'), Def('1', 'int', 'a'), Def('1', 'int', 'a'),
+               Def('3', 'int', 'c')]
+        self.assertEqual([True, True, True, False], match_records(gold, stu))
+        # 每个学生记录只能匹配一次, 多出来的重复记录不算正确
+        self.assertEqual([True, True, True, False, False], [record.passed for record in stu])
+        self.assertNotEqual(Def('2', 'int', 'a'), Ref('2', 'int', 'a', None))
+
+
+class TypeCheckTestCase(unittest.TestCase):
+    def test_annotations(self):
+        gold_xml = '../public/golden/semantic/type/if.xml'
+        self.assertEqual(100, TypeCheckGrader('', '').grade_single(gold_xml, gold_xml).grade)
+        with tempfile.TemporaryDirectory() as tmp:
+            stu_xml = os.path.join(tmp, 'if.xml')
+            with open(stu_xml, 'w') as f:
+                f.write('<TranslationUnit><FuncDecl><name><Id evalType="int">a</Id></name></FuncDecl>'
+                        '<FuncDecl><Id evalType="int">b</Id><Id evalType="char">c</Id></FuncDecl></TranslationUnit>')
+            gold_xml = os.path.join(tmp, 'gold.xml')
+            with open(gold_xml, 'w') as f:
+                f.write('<TranslationUnit><FuncDecl><name><Id evalType="int">a</Id></name></FuncDecl>'
+                        '<FuncDecl><Id evalType="int">b</Id><Id evalType="int">c</Id><Id evalType="int">d</Id>'
+                        '</FuncDecl></TranslationUnit>')
+            report = TypeCheckGrader('', '').grade_single(stu_xml, gold_xml)
+            self.assertEqual([('/TranslationUnit/FuncDecl[2]/Id[2]', 'int', 'char'),
+                              ('/TranslationUnit/FuncDecl[2]/Id[3]', 'int', None)], report.mismatches)
+            self.assertEqual(50, report.grade)
+            self.assertEqual('', report.diff)
+
+
 class MyTestCase(unittest.TestCase):
     def test_cs_run(self):
         runner = Runner(target='cs', output_dir='cs_out', output_extension='xml',